@@ -22,10 +22,24 @@ bacnet = BAC0.connect()
 #BACNET_ADDR = "30100:192.168.1.64:47809"
 BACNET_ADDR = os.getenv('BACNET_ADDR')
 
+# presentValue has no timestamp, so replaying old values during an outage only
+# puts stale readings back on the panel. Only the latest write that failed is
+# kept for each object, {AV: write}, and sent once the panel answers again
+pending = {}
 
 
 while(True):
 
+    # retry the latest failed write of each object, stop at the first failure
+    # as the panel is still unreachable
+    for AV, r in list(pending.items()):
+        try:
+            bacnet.write(r)
+            del pending[AV]
+        except Exception as e:
+            print(datetime.now(), ' panel still unreachable ', e)
+            break
+
     # Get ip addresses and bacnet object numbers from a csv file
     # Name, BACnet Analog Variable Address, Modbus IP address, unit ID, Register, Register Length
     # Laundry Room Inverter,801,192.168.1.160,3,30775,2
@@ -50,7 +64,12 @@ while(True):
             # if success display registers
             if regs:
                 r = BACNET_ADDR + ' analogValue ' + AV + ' presentValue ' + str(regs[1])
-                bacnet.write(r)
+                try:
+                    bacnet.write(r)
+                    pending.pop(AV, None)
+                except Exception as e:
+                    print(datetime.now(), ' unable to write ', r, ' retrying later ', e)
+                    pending[AV] = r
                 #bacnet.write('30100:192.168.1.64:47809 analogValue 800 presentValue' regs_l[1])
                 #print(regs[1])
             else:
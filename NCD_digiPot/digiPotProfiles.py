@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# Runs scripted setpoint profiles on several NCD digipot boards at once, for
+# simulating temperatures on a test rig.
+#
+# Each line of the profiles file drives one board channel with a shape between
+# low and high (digipot values 0-255):
+#   ramp  low to high over period seconds, then held at high
+#   step  low for half of period then high for the other half, repeated
+#   sine  a sine wave from low to high and back every period seconds
+# with a setpoint every interval seconds for duration seconds. Setpoints are
+# scheduled from one shared start time, so a slow ack never pushes the rest of
+# a profile back; a setpoint that is more than an interval late is skipped.
+# Every command is logged with the acknowledged value and its round trip.
+#
+# usage: digiPotProfiles.py [-c <profilesFile>] [-l <logFile>]
+
+import asyncio
+import csv
+import getopt
+import math
+import os
+import sys
+from datetime import datetime
+
+from ncdDigiPot import AsyncDigiPot, DigiPotError
+
+PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "digiPotProfiles.csv")
+USAGE = "digiPotProfiles.py -c <profilesFile> -l <logFile>"
+START_DELAY = 1 # seconds to connect to every board before the profiles start
+
+
+def readProfiles(path):
+    # [(host, channel, shape, low, high, period, interval, duration), ...]
+    profiles = []
+    with open(path, newline='') as f:
+        for x in csv.reader(f):
+            if not x or x[0].strip().startswith("#"):
+                continue
+            host, channel, shape, low, high, period, interval, duration = [i.strip() for i in x]
+            if shape not in SHAPES:
+                raise ValueError("unknown profile shape " + shape)
+            profiles.append((host, int(channel), shape, int(low), int(high), float(period), float(interval), float(duration)))
+    return profiles
+
+
+def ramp(t, period):
+    return min(t / period, 1)
+
+
+def step(t, period):
+    return 0 if t % period < period / 2 else 1
+
+
+def sine(t, period):
+    return (1 - math.cos(2 * math.pi * t / period)) / 2
+
+
+# each shape as a fraction of the way from low to high, t seconds into the profile
+SHAPES = {"ramp": ramp, "step": step, "sine": sine}
+
+
+def profileValue(shape, low, high, period, t):
+    return max(0, min(255, round(low + (high - low) * SHAPES[shape](t, period))))
+
+
+async def runProfile(pot, channel, shape, low, high, period, interval, duration, start, log):
+    loop = asyncio.get_running_loop()
+    for k in range(int(duration // interval) + 1):
+        due = start + k * interval
+        await asyncio.sleep(max(0, due - loop.time()))
+        value = profileValue(shape, low, high, period, k * interval)
+        late = loop.time() - due
+        if late > interval:
+            log(pot.host, channel, value, None, late, "skipped, running late")
+            continue
+        try:
+            latency = await pot.set(value, channel)
+            log(pot.host, channel, value, latency, late, "")
+        except (DigiPotError, OSError) as e:
+            log(pot.host, channel, value, None, late, str(e))
+
+
+async def runProfiles(profiles, log):
+    pots = {host: AsyncDigiPot(host) for host in set(p[0] for p in profiles)}
+    loop = asyncio.get_running_loop()
+    start = loop.time() + START_DELAY
+    # connect up front so the first setpoints aren't late, a board that can't be
+    # reached is retried on every setpoint
+    for host, result in zip(pots, await asyncio.gather(*[pot.connect() for pot in pots.values()], return_exceptions=True)):
+        if isinstance(result, Exception):
+            print(datetime.now(), host, "connect failed:", result)
+    try:
+        await asyncio.gather(*[runProfile(pots[host], *profile, start, log) for host, *profile in profiles])
+    finally:
+        for pot in pots.values():
+            await pot.close()
+
+
+def main(argv):
+    profilesFile = PROFILES_FILE
+    logFile = None
+    try:
+        opts, args = getopt.getopt(argv, "hc:l:", ["profiles=", "log="])
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt in ("-c", "--profiles"):
+            profilesFile = arg
+        elif opt in ("-l", "--log"): # csv log of every command, printed if not given
+            logFile = arg
+
+    profiles = readProfiles(profilesFile)
+    f = open(logFile, "a", newline='') if logFile else sys.stdout
+    writer = csv.writer(f)
+    if not logFile or f.tell() == 0:
+        writer.writerow(["time", "board", "channel", "value", "latency_ms", "late_ms", "error"])
+
+    def log(host, channel, value, latency, late, error):
+        writer.writerow([datetime.now().isoformat(sep=" ", timespec="milliseconds"), host, channel, value,
+            "" if latency is None else round(latency * 1000, 1), round(late * 1000, 1), error])
+        f.flush()
+
+    try:
+        asyncio.run(runProfiles(profiles, log))
+    finally:
+        if logFile:
+            f.close()
+
+
+if __name__ == "__main__": #call main when the script is run directly, and not as a module
+    main(sys.argv[1:])
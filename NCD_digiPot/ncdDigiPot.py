@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# Persistent connection to an NCD digital potentiometer board (ProXR commands
+# over TCP port 2101).
+#
+# A setpoint is the API frame 170, 4, 254, 170, 0, value, checksum: 170 is the
+# API header, 4 the length of the command 254, 170, 0, value and the checksum
+# the sum of every byte before it & 255. The board answers each command with 85,
+# wrapped as 170, 1, 85, 0 when it is in API mode.
+#
+# DigiPot keeps one socket open, so a setpoint costs a round trip instead of a
+# new connection and a fixed 5 second wait. sweep() keeps a few commands in
+# flight at once and matches the acks to them in order, so a sweep runs as fast
+# as the board answers.
+#
+# AsyncDigiPot is the same client for asyncio, for driving many boards at once.
+# Commands to one board (any channel) go one at a time over its connection.
+
+import asyncio
+import socket
+import time
+from collections import deque
+
+PORT = 2101
+HEADER = 170
+ACK = 85
+TIMEOUT = 2.0 # seconds to wait for an ack
+WINDOW = 4 # commands in flight at once in sweep()
+
+
+class DigiPotError(Exception):
+    pass
+
+
+def frame(value, channel=0):
+    # the API frame that sets the pot on channel to value (0-255)
+    if not 0 <= value <= 255:
+        raise ValueError("digipot value %d is outside 0-255" % value)
+    body = bytes([HEADER, 4, 254, 170, channel, value])
+    return body + bytes([sum(body) & 255])
+
+
+def takeReply(buffer):
+    # the payload of the first complete reply in buffer, removed from it, or
+    # None until a whole reply has arrived
+    if not buffer:
+        return None
+    if buffer[0] != HEADER:
+        # a bare reply byte, the board isn't in API mode
+        payload = bytes(buffer[:1])
+        del buffer[:1]
+        return payload
+    if len(buffer) < 2 or len(buffer) < buffer[1] + 3:
+        return None
+    end = buffer[1] + 2
+    payload = bytes(buffer[2:end])
+    if sum(buffer[:end]) & 255 != buffer[end]:
+        raise DigiPotError("bad checksum in reply %s" % list(buffer[:end + 1]))
+    del buffer[:end + 1]
+    return payload
+
+
+class DigiPot:
+
+    def __init__(self, host, port=PORT, channel=0, timeout=TIMEOUT):
+        self.host = host
+        self.port = port
+        self.channel = channel
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = bytearray()
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+            # frames are 7 bytes, don't hold them back waiting to fill a packet
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.buffer = bytearray()
+        return self.sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def readAck(self):
+        # wait up to timeout for the next reply, which must be an ack
+        deadline = time.monotonic() + self.timeout
+        while True:
+            payload = takeReply(self.buffer)
+            if payload is not None:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DigiPotError("no ack from %s within %s s" % (self.host, self.timeout))
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                raise DigiPotError("%s closed the connection" % self.host)
+            self.buffer += data
+        if payload != bytes([ACK]):
+            raise DigiPotError("%s answered %s instead of an ack" % (self.host, list(payload)))
+
+    def sweep(self, values, window=WINDOW, channel=None):
+        # send every value to channel (the DigiPot's own channel if None), up to
+        # window of them before their acks are back, yielding (value, seconds
+        # from send to ack) as each is acknowledged.
+        # After an error the connection is closed, as which commands the board
+        # acted on is unknown, and the next command reconnects
+        if channel is None:
+            channel = self.channel
+        inFlight = deque()
+        values = iter(values)
+        try:
+            sock = self.connect()
+            while True:
+                for value in values:
+                    sock.sendall(frame(value, channel))
+                    inFlight.append((value, time.monotonic()))
+                    if len(inFlight) >= window:
+                        break
+                if not inFlight:
+                    return
+                self.readAck()
+                value, sent = inFlight.popleft()
+                yield value, time.monotonic() - sent
+        except (OSError, DigiPotError):
+            self.close()
+            raise
+        except BaseException:
+            # stopped early by the caller or a bad value, acks still on their
+            # way would be taken for the next command's
+            if inFlight:
+                self.close()
+            raise
+
+    def set(self, value, channel=None):
+        # set channel (the DigiPot's own channel if None) to value and wait for
+        # its ack, returns the round trip in seconds
+        for value, latency in self.sweep([value], 1, channel):
+            return latency
+
+
+class AsyncDigiPot:
+
+    def __init__(self, host, port=PORT, timeout=TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+        self.buffer = bytearray()
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.buffer = bytearray()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
+
+    def drop(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def readAck(self):
+        while True:
+            payload = takeReply(self.buffer)
+            if payload is not None:
+                break
+            data = await self.reader.read(4096)
+            if not data:
+                raise DigiPotError("%s closed the connection" % self.host)
+            self.buffer += data
+        if payload != bytes([ACK]):
+            raise DigiPotError("%s answered %s instead of an ack" % (self.host, list(payload)))
+
+    async def set(self, value, channel=0):
+        # set channel to value and wait for the ack, returns the round trip in
+        # seconds. After an error the connection is closed and the next command reconnects
+        command = frame(value, channel)
+        async with self.lock:
+            try:
+                await self.connect()
+            except asyncio.TimeoutError:
+                self.drop()
+                raise DigiPotError("could not connect to %s:%d within %s s" % (self.host, self.port, self.timeout))
+            except BaseException:
+                self.drop()
+                raise
+            try:
+                sent = time.monotonic()
+                self.writer.write(command)
+                await self.writer.drain()
+                await asyncio.wait_for(self.readAck(), self.timeout)
+                return time.monotonic() - sent
+            except asyncio.TimeoutError:
+                self.drop()
+                raise DigiPotError("no ack from %s within %s s" % (self.host, self.timeout))
+            except BaseException:
+                # failed or cancelled part way, an ack still on its way would
+                # be taken for the next command's
+                self.drop()
+                raise
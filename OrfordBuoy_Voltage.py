@@ -9,7 +9,9 @@ token = os.environ.get("CREDENTIAL_TOKEN")
 
 from zabbix_utils import Sender
 
-from datetime import datetime, timedelta
+from buoyForwarding import forward
+
+from datetime import datetime
 
 #print tehe datetime that the script is run
 print()
@@ -19,25 +21,8 @@ print()
 # Pass a credentials token as the Client Class is initiated
 client = Client(credentials=token)
 
-# Make a data request for chlorophyll data
-url = '%s/%s' % (client.api_root, 'sn/views/OrfordBuoy:Diagnostics?sort=-measurementTime')
-response = client.get(url)
-
-y = response.json() #convert to json
-
-for i in range(0,12):
-        #get data from json and convert time to unix timestamp
-        time = datetime.strptime((y[i]["measurementTime"]),'%Y-%m-%dT%H:%M:%S.%fZ')
-        time = time - timedelta(hours=8) #convert from Zulu to PST
-        epochTime = time.timestamp() #convert to epoch time
-        voltage = (y[i]["OrfordBuoy:BattVolt_Avg"])
-
-        #send data to zabbix
-        sender = Sender(server='127.0.0.1', port=10051)
-        zabbix_response = sender.send_value('OrfordBuoy', 'orfordbuoy.voltage', voltage, epochTime)
-
-        print(time)
-        print(voltage)
+# one sender for the whole run, items are sent in trapper requests of up to chunk_size values
+sender = Sender(server='127.0.0.1', port=10051, chunk_size=250)
 
-        #print(zabbix_response)
-        # {"processed": 1, "failed": 0, "total": 1, "time": "0.000338", "chunk": 1}
\ No newline at end of file
+# Send every Diagnostics record newer than the last one sent to zabbix
+forward(client, sender, 'OrfordBuoy', 'Diagnostics', 'BattVolt_Avg', 'OrfordBuoy', 'orfordbuoy.voltage')
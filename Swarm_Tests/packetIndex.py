@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Persistent index of Swarm packetIds that have already been written, so
+# messages downloaded again (when they are not ACK'd) are not appended twice.
+#
+# The ids are kept as a sorted array of 64 bit integers (8 bytes per packet, so
+# millions of packets fit in a few MB) in <path>, plus <path>.log for ids added
+# since the array was last rewritten. Lookups are a compare against the largest
+# stored id for new packets, which is the usual case, or a binary search.
+#
+# Downloaders running at once can share the index, add and compact hold an
+# flock on <path>.lock and compact rereads both files under it, so ids another
+# process logged are merged in rather than lost with its log.
+
+import fcntl
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from atomicFile import writeAtomic
+
+COMPACT_EVERY = 10000 # ids in the log before it is merged into the sorted array
+
+
+class PacketIndex:
+
+    def __init__(self, path):
+        self.path = path
+        self.logPath = path + ".log"
+        self.lockPath = path + ".lock"
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        # read the sorted array and the log from disk
+        self.ids = array('Q')
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.ids.frombytes(f.read())
+        self.recent = set()
+        if os.path.exists(self.logPath):
+            logged = array('Q')
+            with open(self.logPath, "rb") as f:
+                data = f.read()
+            logged.frombytes(data[:len(data) - len(data) % 8]) # ignore a partly written id
+            self.recent.update(logged)
+        self.largest = self.ids[-1] if self.ids else -1
+
+    def fileLock(self):
+        # an exclusive lock shared with other processes using the index, held
+        # until the returned file is closed
+        f = open(self.lockPath, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
+
+    def __contains__(self, packetId):
+        if packetId in self.recent:
+            return True
+        if packetId > self.largest:
+            return False
+        i = bisect_left(self.ids, packetId)
+        return i < len(self.ids) and self.ids[i] == packetId
+
+    def add(self, packetIds):
+        # record packetIds as written, appended to the log and fsynced
+        with self.lock, self.fileLock():
+            new = array('Q', sorted(set(p for p in packetIds if p not in self)))
+            if not new:
+                return
+            with open(self.logPath, "ab") as f:
+                f.write(new.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.recent.update(new)
+            if len(self.recent) >= COMPACT_EVERY:
+                self.compactLocked()
+
+    def compact(self):
+        # merge the logged ids into the sorted array and start a new log
+        with self.lock, self.fileLock():
+            self.compactLocked()
+
+    def compactLocked(self):
+        # compact with both locks held. The files are read again first, another
+        # process may have logged ids or compacted since this one loaded them
+        self.load()
+        merged = array('Q')
+        for packetId in merge(self.ids, sorted(self.recent)):
+            # two processes can log the same id, keep it once
+            if not merged or merged[-1] != packetId:
+                merged.append(packetId)
+        writeAtomic(self.path, merged.tobytes(), fsync=True)
+        if os.path.exists(self.logPath):
+            os.remove(self.logPath)
+        self.ids = merged
+        self.recent = set()
+        self.largest = merged[-1] if merged else -1
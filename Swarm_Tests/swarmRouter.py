@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Table driven routing of decoded Swarm payloads to LoggerNet .dat files.
+#
+# A payload can hold records from more than one logger, each starting with its
+# own quoted TIMESTAMP, eg.
+# "2022-03-25 16:00:00",0,12.9,16.38,-35.41,94.7,2.283,"2022-03-25 16:00:00",13.6,-24.82,1.264,-24.48
+# The routes file says which record (segment) of a device's payload goes to
+# which .dat file, one line per output:
+#   match, segment, output file, add record number
+# match is a Swarm device id or the -o output the downloader was run with,
+# segment 0 is the whole payload, 1 the first record, 2 the second and so on,
+# and add record number puts a RECORD column of 0 after the timestamp for
+# loggers that don't send one. Devices with no routes get the whole payload
+# written to their -o output.
+#
+# Output files are opened once and kept open for the run; sync() flushes and
+# fsyncs them all, so a page of messages can be made durable before it is ACK'd.
+# One router can be shared by several devices downloading at once.
+
+import csv
+import os
+import re
+import threading
+
+ROUTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "swarm_routes.csv")
+
+# only a quoted date and time starts a record, loggers also quote "NAN" values
+TIMESTAMP = re.compile(r'"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?"')
+
+
+def readRoutes(path):
+    # {match: [(segment, output file, add record number), ...]}
+    routes = {}
+    if not os.path.exists(path):
+        return routes
+    with open(path, newline='') as f:
+        for x in csv.reader(f):
+            if not x or x[0].strip().startswith("#"):
+                continue
+            match, segment, output, addRecord = [i.strip() for i in x]
+            routes.setdefault(match, []).append((int(segment), output, addRecord.lower() in ("yes", "y", "true", "1")))
+    return routes
+
+
+def splitRecords(message):
+    # the payload cut at every quoted timestamp, each record without its trailing comma
+    starts = [m.start() for m in TIMESTAMP.finditer(message)]
+    if not starts:
+        return [message]
+    return [message[a:b].rstrip(",") for a, b in zip(starts, starts[1:] + [len(message)])]
+
+
+def addRecordNumber(record):
+    # "timestamp",values -> "timestamp",0,values
+    end = TIMESTAMP.match(record).end()
+    return record[:end] + ",0" + record[end:]
+
+
+class Router:
+
+    def __init__(self, routesFile=ROUTES_FILE):
+        self.routes = readRoutes(routesFile)
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def writer(self, path):
+        if path not in self.files:
+            self.files[path] = open(path, "a")
+        return self.files[path]
+
+    def route(self, deviceId, output, message):
+        # write one decoded payload to every output its routes send it to
+        routes = self.routes.get(str(deviceId)) or self.routes.get(output) or [(0, output, False)]
+        records = None
+        for segment, path, addRecord in routes:
+            if segment == 0:
+                record = message
+            else:
+                if records is None:
+                    records = splitRecords(message)
+                if segment > len(records):
+                    print("payload from", deviceId, "has no record", segment, ":", message)
+                    continue
+                record = records[segment - 1]
+            if addRecord:
+                record = addRecordNumber(record)
+            with self.lock:
+                self.writer(path).write(record + '\n')
+
+    def sync(self):
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.sync()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
@@ -1,38 +1,56 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-# version 1.0.0
+# version 1.1.0
 from pprint import pprint
 import os
 import sys, getopt
 import base64
 import json
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from packetIndex import PacketIndex
+from swarmRouter import Router, ROUTES_FILE
 from dotenv import load_dotenv
 load_dotenv("/data/sn/.env") #this file has the username and password to access the swarm servers
 
+USAGE = 'swarm_downloader.py -i <deviceId>[,<deviceId>...] -o <outputFile>[,<outputFile>...] -x <packetIndexFile> -r <routesFile> [-d] [-a]'
+
 # add arguments from command line for device id
 def getArgs(argv):
     global outputFile
     global deviceId
+    global drain
+    global doACK
+    global indexFile
+    global routesFile
     deviceId = ''
+    drain = False
+    indexFile = INDEX_FILE
+    routesFile = ROUTES_FILE
     try:
-        opts, args = getopt.getopt(argv,"hi:o:",["ifile=","ofile="])
+        opts, args = getopt.getopt(argv,"hi:o:x:r:da",["ifile=","ofile=","index=","routes=","drain","ack"])
     except getopt.GetoptError:
-        print ('swarm_downloader.py -i <deviceId> -o <outputFile>')
+        print (USAGE)
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print ('swarm_downloader.py -i <deviceId> -o <outputFile>')
+            print (USAGE)
             sys.exit()
         elif opt in ("-i", "--ifile"):
             deviceId = arg
         elif opt in ("-o", "--outputFile"):
             outputFile = arg
+        elif opt in ("-x", "--index"): # packetIds already written, so messages that weren't ACK'd aren't written twice
+            indexFile = arg
+        elif opt in ("-r", "--routes"): # which .dat files each device's payload is written to
+            routesFile = arg
+        elif opt in ("-d", "--drain"): # keep paging until there are no unacknowledged messages left
+            drain = True
+        elif opt in ("-a", "--ack"): # acknowledge messages once they are written
+            doACK = True
 
 
-if __name__ == "__main__": #call the get arguments function when the script is run directly, and not as a module
-   getArgs(sys.argv[1:])
-
 #print(deviceId)
 # define output of the REST request as json
 # and other parameterized values used below
@@ -49,72 +67,146 @@ loginURL = hiveBaseURL + '/login'
 getMessageURL = hiveBaseURL + '/api/v1/messages'
 ackMessageURL = hiveBaseURL + '/api/v1/messages/rxack/{}'
 
+PAGE_SIZE = 50 # messages per request
+ACK_THREADS = 8 # acknowledgements in flight at once
+DEVICE_THREADS = 8 # devices downloaded at once
+INDEX_FILE = "/data/sn/swarm_packets.idx"
+
 # dont do the ACK
-doACK = false
+doACK = False
 
-# create a session
-with requests.Session() as s:
-    # log in to get the JSESSIONID cookie
+
+def login():
+    # create a session and log in to get the JSESSIONID cookie, the session
+    # then manages the cookie for every other request
+    s = requests.Session()
     res = s.post(loginURL, data=loginParams, headers=loginHeaders)
     #print(res.url)
-
-if res.status_code != 200:
-    print("Invalid username or password; please use a valid username and password in loginParams.")
-    exit(1)
-
-# print out the JSESSIONID cookie
-#print(s.cookies)
-
-# let the session manage the cookie and get the output for the given appID
-# only pull the last 10 items that have not been ACK'd
-res = s.get(getMessageURL, headers=hdrs, params={'deviceid':deviceId, 'count': 50, 'status': 0})
-# print(res)
+    if res.status_code != 200:
+        print("Invalid username or password; please use a valid username and password in loginParams.")
+        exit(1)
+    return s
+
+
+def getPage(s, deviceId, before=None):
+    # one page of messages that have not been ACK'd, newest first. before pages
+    # back through the queue to messages older than the given packetId
+    params = {'deviceid': deviceId, 'count': PAGE_SIZE, 'status': 0}
+    if before is not None:
+        params['before'] = before
+    res = s.get(getMessageURL, headers=hdrs, params=params)
+    res.raise_for_status()
+    return res.json()
+
+
+def decodeMessage(item):
+    # the data portion converted from base64 to ascii - assumes not binary
+    return base64.b64decode(item['data']).decode('ascii')
+
+
+def ackMessages(s, packetIds):
+    # acknowledge a page of messages, a few requests at a time over the shared session
+    def ack(packetId):
+        res = s.post(ackMessageURL.format(packetId), headers=hdrs)
+        res.raise_for_status()
+        return res.json()
+    with ThreadPoolExecutor(max_workers=ACK_THREADS) as pool:
+        results = list(pool.map(ack, packetIds))
+    # print out the response from the last ACK request
+    if results:
+        pprint(results[-1])
+    return len(results)
+
+
+def download(s, deviceId, outputFile, router, drain=False, doACK=False, index=None):
+    # fetch the unacknowledged messages, then route them a page at a time to
+    # their .dat files, sync them to disk and only then ACK the page. Without
+    # drain only the first page is fetched. Messages already in the index were
+    # written on an earlier run and are skipped
+    written = 0
+    acked = 0
+    # the api pages newest first, so every page is fetched before any is
+    # written and the .dat files get the oldest page first
+    pages = []
+    before = None
+    while True:
+        messages = getPage(s, deviceId, before)
+        if not messages:
+            break
+        pages.append(messages)
+        if not drain or len(messages) < PAGE_SIZE:
+            break
+        before = min(item['packetId'] for item in messages)
+    for messages in reversed(pages):
+        # and each page oldest first
+        messages = sorted(messages, key=lambda item: item['packetId'])
+        done = []
+        for item in messages:
+            # if there is a 'data' keypair, output the data portion
+            if (item['data']) and (index is None or item['packetId'] not in index):
+                message = decodeMessage(item)
+                print(message + '\n')
+                router.route(deviceId, outputFile, message)
+                written += 1
+            done.append(item['packetId'])
+        router.sync()
+        if index is not None:
+            index.add(done)
+        if doACK:
+            acked += ackMessages(s, done)
+    return written, acked
+
+
+def downloadDevices(s, devices, router, drain=False, doACK=False, index=None):
+    # download several devices at once over the one logged in session.
+    # devices is a list of (deviceId, outputFile); returns
+    # {deviceId: (written, acked, seconds)} with an exception in place of the
+    # counts for a device that failed
+    def timed(deviceId, outputFile):
+        start = time.time()
+        written, acked = download(s, deviceId, outputFile, router, drain, doACK, index)
+        return written, acked, time.time() - start
+    results = {}
+    with ThreadPoolExecutor(max_workers=DEVICE_THREADS) as pool:
+        futures = {deviceId: pool.submit(timed, deviceId, outputFile) for deviceId, outputFile in devices}
+        for deviceId, future in futures.items():
+            try:
+                results[deviceId] = future.result()
+            except Exception as e:
+                results[deviceId] = e
+    return results
 
 
-messages = res.json()
-
-if not messages: #check if any new messages downloaded and exit if none
-    print("No data found")
-    exit(1)
-# print out the prettied version of the JSON records for unacknowledge data records in the hive
-#print(json.dumps(messages, indent=4))
-
-counter = 0 #used to count the number of messages returned and acknowledge them
-# for all the items in the json returned (limited to 10 above)
-for item in messages:
-    # if there is a 'data' keypair, output the data portion converting it from base64 to ascii - assumes not binary
-    if (item['data']):
-        #print('Decoded Message: ' + base64.b64decode(item['data']).decode('ascii') + '\n')
-        # "TIMESTAMP","RECORD","BattVolt_Avg","PanelT_Avg","Turbidity_Avg","Turbidity_Std","Turbidity_Med","TIMESTAMP","BattVolt_Avg","Turbidity2_Avg","Turbidity2_Std","Turbidity2_Med"
-        # "2022-03-25 16:00:00",0,12.9,16.38,-35.41,94.7,2.283,"2022-03-25 16:00:00",13.6,-24.82,1.264,-24.48
-        # Split data at second timestamp and write to different FileLine
-
-        print(base64.b64decode(item['data']).decode('ascii') + '\n')
+if __name__ == "__main__": #call the get arguments function when the script is run directly, and not as a module
+    getArgs(sys.argv[1:])
 
-        if outputFile == "/data/LoggerNet/QuadraData/SGTEUS_OneHour.dat":
-            outputFile2 = "/data/LoggerNet/QuadraData/SGTEDS_OneHour.dat"
-            splitOutput = base64.b64decode(item['data']).decode('ascii').split("\"")
-            sgteUS = ("\"" + x[1] + "\"" + x[2][:-1])
-            sgteDS = ("\"" + x[3] + "\"" + ",0" + x[4])
+    # -i and -o take matching comma separated lists for more than one device
+    deviceIds = deviceId.split(",")
+    outputFiles = outputFile.split(",")
+    if len(outputFiles) != len(deviceIds):
+        print("Give one output file per device id")
+        sys.exit(2)
 
-            f = open(outputFile, "a")
-            f.write(sgteUS + '\n')
-            f.close()
+    s = login()
 
-            f = open(outputFile2, "a")
-            f.write(sgteDS + '\n')
-            f.close()
+    # print out the JSESSIONID cookie
+    #print(s.cookies)
 
+    router = Router(routesFile)
+    try:
+        results = downloadDevices(s, list(zip(deviceIds, outputFiles)), router, drain, doACK, PacketIndex(indexFile))
+    finally:
+        router.close()
+
+    total = 0
+    for deviceId, result in results.items():
+        if isinstance(result, Exception):
+            print(deviceId, "failed:", result)
         else:
-            f = open(outputFile, "a")
-            f.write(base64.b64decode(item['data']).decode('ascii') + '\n')
-            f.close()
-
-        # example ACK the first item returned ONLY!
-        if (doACK):
-            # note you should check the initial return to make sure there are packets available before you ack one
-            res1 = s.post(ackMessageURL.format(messages[counter]['packetId']), headers=hdrs)
-
-            # print out the response from the ACK request
-            pprint(res1.json())
-    counter +=1
+            written, acked, seconds = result
+            total += written
+            print(deviceId, written, "messages written,", acked, "acknowledged in", round(seconds, 2), "s")
+
+    if not total: #check if any new messages downloaded and exit if none
+        print("No data found")
+        exit(1)
@@ -0,0 +1,29 @@
+# run with: python -m pytest Swarm_Tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from swarmRouter import Router, splitRecords, addRecordNumber
+
+NAN_PAYLOAD = '"2022-03-25 16:00:00",0,"NAN",16.38,"2022-03-25 16:00:00",13.6,"NAN"'
+
+
+def test_quoted_nan_does_not_start_a_record():
+    assert splitRecords(NAN_PAYLOAD) == ['"2022-03-25 16:00:00",0,"NAN",16.38', '"2022-03-25 16:00:00",13.6,"NAN"']
+
+
+def test_record_number_goes_after_the_timestamp():
+    assert addRecordNumber('"2022-03-25 16:00:00",13.6,"NAN"') == '"2022-03-25 16:00:00",0,13.6,"NAN"'
+
+
+def test_nan_payload_routes_each_logger_to_its_file(tmp_path):
+    upstream = str(tmp_path / "SGTEUS_OneHour.dat")
+    downstream = str(tmp_path / "SGTEDS_OneHour.dat")
+    routes = tmp_path / "routes.csv"
+    routes.write_text("%s,1,%s,no\n%s,2,%s,yes\n" % (upstream, upstream, upstream, downstream))
+    router = Router(str(routes))
+    router.route("12345", upstream, NAN_PAYLOAD)
+    router.close()
+    assert open(upstream).read() == '"2022-03-25 16:00:00",0,"NAN",16.38\n'
+    assert open(downstream).read() == '"2022-03-25 16:00:00",0,13.6,"NAN"\n'
@@ -0,0 +1,27 @@
+# Whole-file writes that readers never see half done.
+# The data goes to a uniquely named temp file in the same directory, which is
+# then renamed over the target, so a crash leaves the old file and two
+# processes writing the same file at once never share a temp file.
+
+import os
+import tempfile
+
+
+def writeAtomic(path, data, fsync=False, mode=0o644):
+        #data is str (written as utf-8) or bytes. fsync makes the new contents
+        #durable before the rename, for state that must survive a power cut
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+        try:
+                with os.fdopen(fd, "wb") as f:
+                        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+                        if fsync:
+                                f.flush()
+                                os.fsync(f.fileno())
+                os.chmod(tmp, mode)
+                os.replace(tmp, path)
+        except BaseException:
+                try:
+                        os.remove(tmp)
+                except OSError:
+                        pass
+                raise
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Benchmark of the zabbix send side of the buoy forwarding against the local
+# fake trapper. Compares the old one Sender and send_value per item path with
+# buoyForwarding.sendItems, which the forwarding scripts use now (a check of the
+# spool then batched sends), at a realistic run size and 100x it. Fetching from
+# the Hakai API is not included.
+#
+# Latency is per item, from the time it was handed to a sender to the time the
+# trapper accepted it.
+#
+# usage: benchmarkForwarding.py -l <trapperLatencySeconds> -n <repeats>
+
+import getopt
+import statistics
+import sys
+import tempfile
+import time
+
+from zabbix_utils import Sender, ItemValue
+
+from buoyForwarding import sendItems
+from spool import Spool
+from zabbixFakeTrapper import FakeTrapper
+
+USAGE = "benchmarkForwarding.py -l <trapperLatencySeconds> -n <repeats>"
+
+# two buoys, 12 values each, is what a cron run used to send
+REALISTIC_ITEMS = 24
+
+
+def makeItems(count):
+        start = int(time.time()) - count * 300
+        return [ItemValue("Buoy%d" % (i % 2), "buoy.voltage", 12 + (i % 100) / 100, start + i * 300) for i in range(count)]
+
+
+def sendPerItem(port, items, sent):
+        #sent gets the time each item (by clock) was handed to a sender
+        for i in items:
+                sender = Sender(server='127.0.0.1', port=port)
+                sent[i.clock] = time.time()
+                sender.send_value(i.host, i.key, i.value, i.clock)
+
+
+def sendForwarded(port, items, sent):
+        sender = Sender(server='127.0.0.1', port=port, chunk_size=250)
+        with tempfile.TemporaryDirectory() as spoolDir:
+                start = time.time()
+                for i in items:
+                        sent[i.clock] = start
+                sendItems(sender, items, Spool(spoolDir))
+
+
+def measure(trapper, send, count, repeats):
+        rates = []
+        latencies = []
+        for r in range(repeats):
+                items = makeItems(count)
+                trapper.reset()
+                sent = {}
+                start = time.time()
+                send(trapper.port, items, sent)
+                elapsed = time.time() - start
+                rates.append(count / elapsed)
+                latencies.extend(received - sent[int(item["clock"])] for received, item in trapper.items)
+                if len(trapper.items) != count:
+                        print("  warning:", len(trapper.items), "of", count, "items received")
+        latencies.sort()
+        return statistics.median(rates), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(argv):
+        latency = 0
+        repeats = 5
+        try:
+                opts, args = getopt.getopt(argv, "hl:n:", ["latency=", "repeats="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-l", "--latency"):
+                        latency = float(arg)
+                elif opt in ("-n", "--repeats"):
+                        repeats = int(arg)
+
+        trapper = FakeTrapper(latency=latency).start()
+        print("fake trapper on port", trapper.port, "with", latency, "s latency")
+        print("%-10s %-8s %12s %14s %14s" % ("path", "items", "items/s", "p50 latency", "p99 latency"))
+        try:
+                for count in (REALISTIC_ITEMS, REALISTIC_ITEMS * 100):
+                        for name, send in (("per item", sendPerItem), ("sendItems", sendForwarded)):
+                                rate, p50, p99 = measure(trapper, send, count, repeats)
+                                print("%-10s %-8d %12.0f %13.1fms %13.1fms" % (name, count, rate, p50 * 1000, p99 * 1000))
+        finally:
+                trapper.stop()
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
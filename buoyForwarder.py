@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Long running buoy telemetry forwarder, replaces one cron script per buoy.
+# Reads station/variable -> zabbix host/key lines from buoyForwarder.csv, keeps
+# one logged in Hakai client, polls every station on its own interval and
+# sends the new values to zabbix in batches.
+#
+# usage: buoyForwarder.py [-c <configFile>] [-w <watermarkFile>] [-s <spoolDir>] [-t <threads>]
+
+import csv
+import getopt
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from hakai_api import Client
+from dotenv import load_dotenv
+from zabbix_utils import Sender
+
+from buoyForwarding import WATERMARK_FILE, SPOOL_DIR, loadWatermarks, updateWatermarks, newItems, sendItems
+from spool import Spool
+
+envPath = "/home/hakai/zabbix_scripts/.env"
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "buoyForwarder.csv")
+USAGE = "buoyForwarder.py -c <configFile> -w <watermarkFile> -s <spoolDir> -t <threads>"
+
+
+def readConfig(path):
+        #{(station, view, interval): [(variable, host, key), ...]}
+        #lines are: station, view, variable, zabbix host, zabbix key, poll interval in seconds
+        groups = {}
+        with open(path, newline='') as f:
+                for x in csv.reader(f):
+                        if not x or x[0].strip().startswith("#"):
+                                continue
+                        station, view, variable, host, key, interval = [i.strip() for i in x]
+                        groups.setdefault((station, view, int(interval)), []).append((variable, host, key))
+        return groups
+
+
+def poll(client, station, view, targets, watermarks):
+        try:
+                return newItems(client, station, view, targets, watermarks)
+        except Exception as e:
+                print(datetime.now(), station, view, "poll failed:", e)
+                return [], {}
+
+
+def run(client, sender, groups, watermarkFile, spool, threads):
+        watermarks = loadWatermarks(watermarkFile)
+        nextPoll = {group: 0 for group in groups}
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+                while True:
+                        now = time.time()
+                        due = [group for group, when in nextPoll.items() if when <= now]
+                        #poll every station that is due at the same time, then send what they found as one batch
+                        futures = [pool.submit(poll, client, station, view, groups[(station, view, interval)], watermarks) for station, view, interval in due]
+                        items = []
+                        marks = {}
+                        for future in futures:
+                                groupItems, groupMarks = future.result()
+                                items.extend(groupItems)
+                                marks.update(groupMarks)
+                        for station, view, interval in due:
+                                nextPoll[(station, view, interval)] = now + interval
+                        marks = {k: v for k, v in marks.items() if v is not None and v != watermarks.get(k)}
+                        #values that can't be sent are spooled, so the watermarks can always move up
+                        zabbix_response = sendItems(sender, items, spool)
+                        if items:
+                                print(datetime.now(), len(items), "values from", len(due), "stations", zabbix_response)
+                        if marks:
+                                watermarks = updateWatermarks(marks, watermarkFile)
+                        time.sleep(max(0, min(nextPoll.values()) - time.time()))
+
+
+def main(argv):
+        configFile = CONFIG_FILE
+        watermarkFile = WATERMARK_FILE
+        spoolDir = SPOOL_DIR
+        threads = 4
+        try:
+                opts, args = getopt.getopt(argv, "hc:w:s:t:", ["config=", "watermarks=", "spool=", "threads="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-c", "--config"):
+                        configFile = arg
+                elif opt in ("-w", "--watermarks"):
+                        watermarkFile = arg
+                elif opt in ("-s", "--spool"):
+                        spoolDir = arg
+                elif opt in ("-t", "--threads"):
+                        threads = int(arg)
+
+        load_dotenv(dotenv_path=envPath)
+        token = os.environ.get("CREDENTIAL_TOKEN")
+
+        groups = readConfig(configFile)
+        print(datetime.now(), "forwarding", sum(len(t) for t in groups.values()), "variables from", len(groups), "station views")
+
+        # one client and one sender for the life of the process
+        client = Client(credentials=token)
+        sender = Sender(server='127.0.0.1', port=10051, chunk_size=250)
+        run(client, sender, groups, watermarkFile, Spool(spoolDir), threads)
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
@@ -0,0 +1,131 @@
+# Shared code for forwarding buoy data from the Hakai API to Zabbix.
+# Each host/key keeps a high-water mark (the last measurementTime sent) in a
+# small json file, so every run asks only for newer records and sends exactly those.
+# The cron scripts and buoyForwarder.py can share the file, so marks are merged
+# into it under a lock rather than the whole file being overwritten.
+
+import fcntl
+import json
+import os
+from datetime import datetime, timedelta
+
+from zabbix_utils import ItemValue
+
+from atomicFile import writeAtomic
+from spool import Spool
+
+WATERMARK_FILE = "/home/hakai/zabbix_scripts/watermarks.json"
+SPOOL_DIR = "/home/hakai/zabbix_scripts/spool/zabbix"
+PAGE_SIZE = 500
+INITIAL_ROWS = 12 #records sent the first time a host/key is seen, as the scripts used to
+HTTP_TIMEOUT = (10, 60) #seconds to connect and to wait for data, so a stuck API call fails the poll instead of hanging it
+
+
+def loadWatermarks(path=WATERMARK_FILE):
+        #{"host/key": "measurementTime of the last record sent"}
+        if not os.path.exists(path):
+                return {}
+        with open(path) as f:
+                return json.load(f)
+
+
+def saveWatermarks(watermarks, path=WATERMARK_FILE):
+        #written atomically so a crash never leaves a half written file
+        writeAtomic(path, json.dumps(watermarks, indent=1, sort_keys=True))
+
+
+def updateWatermarks(marks, path=WATERMARK_FILE):
+        #merge marks into the file under an exclusive lock, reloading it first so
+        #marks saved by another process since this one loaded them are kept. A
+        #mark only ever moves up. Returns every watermark in the file
+        with open(path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                watermarks = loadWatermarks(path)
+                newer = {k: v for k, v in marks.items() if v is not None and (watermarks.get(k) is None or v > watermarks[k])}
+                if newer:
+                        watermarks.update(newer)
+                        saveWatermarks(watermarks, path)
+                return watermarks
+
+
+def fetchSince(client, station, view, since, pageSize=PAGE_SIZE):
+        #records newer than since in time order, paged by measurementTime so a
+        #long backlog comes down in pages of pageSize
+        while True:
+                url = '%s/%s' % (client.api_root, 'sn/views/%s:%s?sort=measurementTime&limit=%d&measurementTime>%s' % (station, view, pageSize, since))
+                response = client.get(url, timeout=HTTP_TIMEOUT)
+                response.raise_for_status()
+                rows = response.json()
+                yield from rows
+                if len(rows) < pageSize:
+                        break
+                since = rows[-1]["measurementTime"]
+
+
+def fetchLatest(client, station, view, count=INITIAL_ROWS):
+        #newest count records, oldest first
+        url = '%s/%s' % (client.api_root, 'sn/views/%s:%s?sort=-measurementTime&limit=%d' % (station, view, count))
+        response = client.get(url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return list(reversed(response.json()))
+
+
+def zabbixClock(measurementTime):
+        #convert the api time to the unix timestamp zabbix has always been sent
+        time = datetime.strptime(measurementTime,'%Y-%m-%dT%H:%M:%S.%fZ')
+        time = time - timedelta(hours=8) #convert from Zulu to PST
+        return int(time.timestamp()) #convert to epoch time
+
+
+def newItems(client, station, view, targets, watermarks):
+        #items for every record after each target's watermark and the new
+        #watermarks. targets is a list of (variable, host, key) that all come
+        #from the same station view, so the records are only fetched once
+        marks = {host + "/" + key: watermarks.get(host + "/" + key) for variable, host, key in targets}
+        known = [mark for mark in marks.values() if mark is not None]
+        if not known:
+                rows = fetchLatest(client, station, view)
+        else:
+                rows = fetchSince(client, station, view, min(known))
+        items = []
+        for row in rows:
+                time = row["measurementTime"]
+                for variable, host, key in targets:
+                        mark = marks[host + "/" + key]
+                        if mark is not None and time <= mark:
+                                continue
+                        value = row.get(station + ":" + variable)
+                        if value is not None:
+                                items.append(ItemValue(host, key, value, zabbixClock(time)))
+                for variable, host, key in targets:
+                        if marks[host + "/" + key] is None or time > marks[host + "/" + key]:
+                                marks[host + "/" + key] = time
+        return items, marks
+
+
+def sendItems(sender, items, spool):
+        #send anything spooled during an earlier outage first, so zabbix gets the
+        #values in order, then the new items. If zabbix can't be reached the new
+        #items go to the spool instead and are sent once it is back
+        try:
+                spool.drain(lambda batch: sender.send([ItemValue(r["host"], r["key"], r["value"], r["clock"]) for r in batch]), batchSize=1000, ratePerSecond=2000)
+                if items:
+                        return sender.send(items)
+        except Exception as e:
+                print("zabbix send failed, spooling", len(items), "values:", e)
+                spool.append([{"host": i.host, "key": i.key, "value": i.value, "clock": i.clock} for i in items])
+        return None
+
+
+def forward(client, sender, station, view, variable, host, key, watermarkFile=WATERMARK_FILE, spoolDir=SPOOL_DIR):
+        #send everything newer than the watermark, then move the watermark up.
+        #The mark is only saved once the values are sent or safely spooled
+        watermarks = loadWatermarks(watermarkFile)
+        items, marks = newItems(client, station, view, [(variable, host, key)], watermarks)
+        zabbix_response = sendItems(sender, items, Spool(spoolDir))
+        if items:
+                print(host, key, len(items), "values up to", marks[host + "/" + key], zabbix_response)
+        else:
+                print(host, key, "no new data")
+        updateWatermarks(marks, watermarkFile)
+        return zabbix_response
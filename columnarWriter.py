@@ -0,0 +1,130 @@
+# Typed columnar (Parquet or Arrow IPC) output for downloadApi.py.
+# Rows are buffered and written out one row group at a time, so large extracts
+# never have to be held in memory. Needs pyarrow (pip install pyarrow).
+#
+# Column types come from the first row group. A float64 column that later
+# holds text (a QC flag column that was empty at first, say) is promoted to
+# string: the row groups already written are read back and written again with
+# the wider schema. If writing fails the partial file is removed.
+
+import os
+
+try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+except ImportError:
+        pa = None
+
+FORMATS = ("parquet", "arrow")
+
+
+class ColumnarWriter:
+
+        def __init__(self, path, columns, format="parquet", rowGroupSize=65536):
+                #columns are the value columns, a measurementTime timestamp column is always first
+                if pa is None:
+                        raise ImportError("pyarrow is needed for parquet/arrow output (pip install pyarrow)")
+                if format not in FORMATS:
+                        raise ValueError("unknown output format " + format + ", use one of " + ", ".join(FORMATS))
+                self.path = path
+                self.columns = columns
+                self.format = format
+                self.rowGroupSize = rowGroupSize
+                self.times = []
+                self.values = [[] for c in columns]
+                self.schema = None
+                self.writer = None
+
+        def write(self, row):
+                #row is [measurementTime, value, value, ...] in the column order
+                self.times.append(row[0])
+                for values, value in zip(self.values, row[1:]):
+                        values.append(None if value == "" else value)
+                if len(self.times) >= self.rowGroupSize:
+                        self.flush()
+
+        def columnType(self, values):
+                #numbers (and empty values) become float64, anything else is kept as text
+                for value in values:
+                        if value is not None and not isinstance(value, (int, float)):
+                                return pa.string()
+                return pa.float64()
+
+        def open(self, schema=None):
+                #the schema is taken from the types seen in the first row group
+                if schema is None:
+                        fields = [pa.field("measurementTime", pa.timestamp("ms", tz="UTC"))]
+                        fields += [pa.field(c, self.columnType(v)) for c, v in zip(self.columns, self.values)]
+                        schema = pa.schema(fields)
+                self.schema = schema
+                if self.format == "parquet":
+                        self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+                else:
+                        self.writer = pa.ipc.new_file(self.path, self.schema)
+
+        def promote(self, names):
+                #rewrite what has been written so far with the named columns as string
+                self.writer.close()
+                if self.format == "parquet":
+                        written = pq.read_table(self.path)
+                else:
+                        with pa.ipc.open_file(self.path) as f:
+                                written = f.read_all()
+                schema = pa.schema([pa.field(f.name, pa.string()) if f.name in names else f for f in self.schema])
+                columns = []
+                for field, column in zip(schema, written.columns):
+                        if field.name in names:
+                                column = pa.array([None if v is None else str(v) for v in column.to_pylist()], type=pa.string())
+                        columns.append(column)
+                self.open(schema)
+                for batch in pa.Table.from_arrays(columns, schema=schema).to_batches():
+                        self.writeBatch(batch)
+
+        def writeBatch(self, batch):
+                if self.format == "parquet":
+                        self.writer.write_batch(batch)
+                else:
+                        self.writer.write(batch)
+
+        def flush(self):
+                if not self.times:
+                        return
+                try:
+                        self.writeRowGroup()
+                except Exception:
+                        self.discard()
+                        raise
+                self.times = []
+                self.values = [[] for c in self.columns]
+
+        def discard(self):
+                #don't leave a half written file behind
+                if self.writer is not None:
+                        try:
+                                self.writer.close()
+                        except Exception:
+                                pass
+                        self.writer = None
+                if os.path.exists(self.path):
+                        os.remove(self.path)
+
+        def writeRowGroup(self):
+                if self.writer is None:
+                        self.open()
+                else:
+                        text = [f.name for f, values in zip(list(self.schema)[1:], self.values) if f.type == pa.float64() and self.columnType(values) == pa.string()]
+                        if text:
+                                self.promote(text)
+                arrays = [pa.array(self.times).cast(self.schema.field(0).type)]
+                for field, values in zip(list(self.schema)[1:], self.values):
+                        if field.type == pa.string():
+                                values = [None if v is None else str(v) for v in values]
+                        arrays.append(pa.array(values, type=field.type))
+                self.writeBatch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+        def close(self):
+                self.flush()
+                if self.writer is None:
+                        #no rows at all, still leave an empty file with the columns
+                        self.open()
+                self.writer.close()
@@ -1,77 +1,343 @@
-# Example using hakai_api_client_python library
-from hakai_api import Client
-import sys, getopt
-
-
-argv = sys.argv[1:]
-station = ''
-begin = ''
-end = ''
-variable = ''
-all = ''
-outputFile = ''
-
-#parse arguments and assign to variables
-try:
-   opts, args = getopt.getopt(argv,"hs:b:e:v:a:f:",["station=","begin=","end=","variable=","all=","outputFile="])
-except getopt.GetoptError:
-   print 'test.py -s <stationName> -b <beginDate> -e <endDate> -v <variable> -a <all> -f <outputfile>'
-   sys.exit(2)
-for opt, arg in opts:
-   if opt == '-h':
-      print 'test.py -s <stationName> -b <beginDate> -e <endDate> -v <variableName>'
-      sys.exit()
-   elif opt in ("-s", "--stationName"):
-      station = arg
-   elif opt in ("-b", "--beginDate"):
-      begin = arg
-   elif opt in ("-e", "--endDate"):
-      end = arg
-   elif opt in ("-v", "--variableName"):
-      variable = arg
-   elif opt in ("-a", "--allData"):
-      all = arg
-   elif opt in ("-f", "--outputFileName"):
-      outputFile = arg
-
-if station == "": #check for station name
-        print "Station name required (eg. -s SSN693DS)"
-        sys.exit(2)
-
-if begin != "": #check for begin date. If not present, no end date will be passed either
-        begin = "?measurementTime>=" + begin
-
-        if end != "":
-                end = "&measurementTime<=" + end
-else:
-        end = ""
-
-if all != "": #if present in command, get all data, otherwise just the first 20 records are returned from the api
-        all = "&limit=-l"
-
-
-client = Client()
-
-url = "https://hecate.hakai.org/api/sn/views/" + station + ":5minuteSamples" + begin + end + all
-print url
-
-response = client.get(url)
-
-data = response.json()
-#check if a filter variable is present. If not, print all data
-if variable != "":
-        filter = station + ":" + variable
-        f = open(outputFile, 'a')
-        for i in data:
-                output = str( i['measurementTime']) + "," + str(i[filter]) + "\n"
-                f.write(output)
-else:
-        f = open(outputFile, 'a')
-        f.write(str(data))
-
-
-#use arguments to define the station, date and data
-#https://hecate.hakai.org/api/sn/views/SSN693DS:5minuteSamples?measurementTime%3E=2016-01-01&measurementTime%3C=2016-02-01
-#for station only need name SSN693DS and assume :5minuteSamples
-#for date always ask for start and end
-#for data if not filled out, return all. Need to think about the output format some more
+# Example using hakai_api_client_python library
+from hakai_api import Client
+import sys, getopt
+import csv
+import heapq
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from hakaiCache import ResponseCache
+from columnarWriter import ColumnarWriter
+
+USAGE = '''downloadApi.py -s <stationName> -b <beginDate> -e <endDate> -v <variable> -a <all> -f <outputfile> -w <windowDays> -t <threads> -c <cacheFile> -o <csv|parquet|arrow>
+batch: downloadApi.py -l <station:variable,...> | -m <manifestFile> -b <beginDate> -e <endDate> -f <wideOutputFile> | -d <outputDir>'''
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def parseDate(value):
+        #accept 2016-01-01, 2016-01-01T00:00:00 or 2016-01-01T00:00:00.000Z
+        return datetime.fromisoformat(value.rstrip('Z'))
+
+
+def splitRange(begin, end, windowDays):
+        #split begin..end into consecutive windows of windowDays. Every window is
+        #half open except the last one, so rows on a boundary are only fetched once
+        windows = []
+        step = timedelta(days=windowDays)
+        start = begin
+        while start + step < end:
+                windows.append((start, start + step, "<"))
+                start = start + step
+        windows.append((start, end, "<="))
+        return windows
+
+
+def windowUrl(client, station, start, stop, stopOperator):
+        #sorted oldest first, the windows are joined end to end and the stations
+        #merged on measurementTime, which both assume ascending rows
+        query = "measurementTime>=" + start.strftime(TIME_FORMAT) + "&measurementTime" + stopOperator + stop.strftime(TIME_FORMAT) + "&sort=measurementTime&limit=-1"
+        return '%s/%s' % (client.api_root, 'sn/views/' + station + ':5minuteSamples?' + query)
+
+
+def fetchRows(client, url):
+        response = client.get(url)
+        response.raise_for_status()
+        return response.json()
+
+
+def fetchWindows(client, urls, threads, pool=None):
+        #fetch the windows concurrently over the shared client session but hand
+        #each window's rows back in order. Only a few windows are in flight at
+        #once so memory stays flat however long the requested range is.
+        #Batch mode passes in one pool shared by every station
+        if pool is None:
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                        yield from fetchWindows(client, urls, threads, pool)
+                return
+        pending = deque()
+        for url in urls:
+                pending.append(pool.submit(fetchRows, client, url))
+                if len(pending) >= threads * 2:
+                        yield pending.popleft().result()
+        while pending:
+                yield pending.popleft().result()
+
+
+def fillCache(client, cache, stations, begin, end, windowDays, threads, pool=None):
+        #fetch the parts of begin..end the cache doesn't hold yet for every
+        #station, all through the same bounded set of concurrent requests
+        view = "5minuteSamples"
+        windows = []
+        for station in stations:
+                for gapStart, gapEnd in cache.missing(station, view, begin, end):
+                        print(station, "fetching", gapStart.strftime(TIME_FORMAT), "to", gapEnd.strftime(TIME_FORMAT))
+                        windows.extend((station,) + window for window in splitRange(gapStart, gapEnd, windowDays))
+        urls = [windowUrl(client, station, start, finish, operator) for station, start, finish, operator in windows]
+        for (station, start, finish, operator), rows in zip(windows, fetchWindows(client, urls, threads, pool)):
+                cache.store(station, view, start, finish, rows)
+
+
+def fetchCached(client, cache, station, begin, end, windowDays, threads, pool=None):
+        #fetch only the missing parts of begin..end, then serve the whole range from the cache
+        fillCache(client, cache, [station], begin, end, windowDays, threads, pool)
+        return cache.rows(station, "5minuteSamples", begin, end)
+
+
+def fetchStation(client, cache, station, begin, end, windowDays, threads, pool=None):
+        #all rows for one station over begin..end, from the cache if there is one
+        if cache is not None:
+                return fetchCached(client, cache, station, begin, end, windowDays, threads, pool)
+        windows = splitRange(begin, end, windowDays)
+        urls = [windowUrl(client, station, start, finish, operator) for start, finish, operator in windows]
+        print(station, "from", begin.strftime(TIME_FORMAT), "to", end.strftime(TIME_FORMAT), "in", len(urls), "windows")
+        return (i for window in fetchWindows(client, urls, threads, pool) for i in window)
+
+
+def readManifest(path):
+        #one station:variable per line, blank lines and # comments are skipped
+        pairs = []
+        with open(path) as f:
+                for line in f:
+                        line = line.split("#")[0].strip()
+                        if line != "":
+                                pairs.extend(line.split(","))
+        return pairs
+
+
+def groupPairs(pairs):
+        #{station: [variable, ...]} in the order given, so each station is only fetched once
+        stations = {}
+        for pair in pairs:
+                station, variable = pair.strip().split(":", 1)
+                stations.setdefault(station, [])
+                if variable not in stations[station]:
+                        stations[station].append(variable)
+        return stations
+
+
+def tagRows(station, rows):
+        for i in rows:
+                yield i['measurementTime'], station, i
+
+
+def mergeStations(streams):
+        #merge the time ordered row streams of several stations into
+        #(measurementTime, {station: row}) groups, still in time order
+        tagged = [tagRows(station, rows) for station, rows in streams.items()]
+        group = None
+        for time, station, row in heapq.merge(*tagged, key=lambda x: x[0]):
+                if group is not None and group[0] != time:
+                        yield group
+                        group = None
+                if group is None:
+                        group = (time, {})
+                group[1][station] = row
+        if group is not None:
+                yield group
+
+
+class CsvTable:
+
+        def __init__(self, path, columns, header=True):
+                self.f = open(path, 'a', newline='')
+                self.writer = csv.writer(self.f)
+                #only a new or empty file needs the header, appending to an
+                #existing table would repeat it part way down
+                if header and self.f.tell() == 0:
+                        self.writer.writerow(["measurementTime"] + columns)
+
+        def write(self, row):
+                self.writer.writerow(row)
+
+        def close(self):
+                self.f.close()
+
+
+def openTable(path, columns, format, header=True):
+        #csv tables are appended to, parquet and arrow files are written fresh
+        if format == "csv":
+                return CsvTable(path, columns, header)
+        return ColumnarWriter(path, columns, format)
+
+
+def writeWide(groups, outputFile, stations, format="csv"):
+        columns = [station + ":" + variable for station, variables in stations.items() for variable in variables]
+        count = 0
+        table = openTable(outputFile, columns, format)
+        try:
+                for time, rows in groups:
+                        line = [time]
+                        for station, variables in stations.items():
+                                row = rows.get(station, {})
+                                line.extend(row.get(station + ":" + variable, "") for variable in variables)
+                        table.write(line)
+                        count += 1
+        finally:
+                table.close()
+        return count
+
+
+def writePerStation(groups, outputDir, stations, format="csv"):
+        #one file per station, all written in the same pass over the merged rows
+        tables = {}
+        count = 0
+        try:
+                for station, variables in stations.items():
+                        tables[station] = openTable(os.path.join(outputDir, station + "." + format), [station + ":" + variable for variable in variables], format)
+                for time, rows in groups:
+                        for station, row in rows.items():
+                                tables[station].write([time] + [row.get(station + ":" + variable, "") for variable in stations[station]])
+                                count += 1
+        finally:
+                for table in tables.values():
+                        table.close()
+        return count
+
+
+def runBatch(client, cache, stations, begin, end, windowDays, threads, outputFile, outputDir, format="csv"):
+        #every station shares the one authenticated client and one pool of
+        #threads, so the total number of requests in flight stays bounded
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+                if cache is not None:
+                        fillCache(client, cache, stations, begin, end, windowDays, threads, pool)
+                streams = {}
+                for station in stations:
+                        streams[station] = fetchStation(client, cache, station, begin, end, windowDays, threads, pool)
+                groups = mergeStations(streams)
+                if outputDir != "":
+                        return writePerStation(groups, outputDir, stations, format)
+                return writeWide(groups, outputFile, stations, format)
+
+
+def writeRows(rows, outputFile, station, variable, format="csv"):
+        count = 0
+        table = None
+        try:
+                #check if a filter variable is present. If not, write all columns
+                if variable != "":
+                        filter = station + ":" + variable
+                        table = openTable(outputFile, [filter], format, header=False)
+                        for i in rows:
+                                table.write([i['measurementTime'], i[filter]])
+                                count += 1
+                else:
+                        for i in rows:
+                                if table is None:
+                                        columns = [c for c in i.keys() if c != 'measurementTime']
+                                        table = openTable(outputFile, columns, format)
+                                table.write([i['measurementTime']] + [i.get(c, "") for c in columns])
+                                count += 1
+        finally:
+                if table is not None:
+                        table.close()
+        return count
+
+
+def main(argv):
+        station = ''
+        begin = ''
+        end = ''
+        variable = ''
+        all = ''
+        outputFile = ''
+        windowDays = 7
+        threads = 4
+        cacheFile = ''
+        pairs = []
+        outputDir = ''
+        format = 'csv'
+
+        #parse arguments and assign to variables
+        try:
+                opts, args = getopt.getopt(argv,"hs:b:e:v:a:f:w:t:c:l:m:d:o:",["station=","begin=","end=","variable=","all=","outputFile=","window=","threads=","cache=","list=","manifest=","outputDir=","format="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-s", "--station"):
+                        station = arg
+                elif opt in ("-b", "--begin"):
+                        begin = arg
+                elif opt in ("-e", "--end"):
+                        end = arg
+                elif opt in ("-v", "--variable"):
+                        variable = arg
+                elif opt in ("-a", "--all"):
+                        all = arg
+                elif opt in ("-f", "--outputFile"):
+                        outputFile = arg
+                elif opt in ("-w", "--window"):
+                        windowDays = float(arg)
+                elif opt in ("-t", "--threads"):
+                        threads = int(arg)
+                elif opt in ("-c", "--cache"):
+                        cacheFile = arg
+                elif opt in ("-l", "--list"):
+                        pairs.extend(arg.split(","))
+                elif opt in ("-m", "--manifest"):
+                        pairs.extend(readManifest(arg))
+                elif opt in ("-d", "--outputDir"):
+                        outputDir = arg
+                elif opt in ("-o", "--format"):
+                        format = arg
+
+        if format not in ("csv", "parquet", "arrow"):
+                print("Output format must be csv, parquet or arrow")
+                sys.exit(2)
+
+        if pairs:
+                #batch mode, many station:variable pairs over one shared time range
+                if begin == "":
+                        print("Batch mode needs a begin date (eg. -b 2016-01-01)")
+                        sys.exit(2)
+                stations = groupPairs(pairs)
+                start = parseDate(begin)
+                stop = parseDate(end) if end != "" else datetime.utcnow()
+                cache = ResponseCache(cacheFile) if cacheFile != "" else None
+                client = Client()
+                count = runBatch(client, cache, stations, start, stop, windowDays, threads, outputFile, outputDir, format)
+                print(count, "rows written for", len(stations), "stations")
+                return
+
+        if station == "": #check for station name
+                print("Station name required (eg. -s SSN693DS)")
+                sys.exit(2)
+
+        client = Client()
+
+        if begin != "" and all != "":
+                #a bounded range of all data, split it into windows and stream it
+                start = parseDate(begin)
+                stop = parseDate(end) if end != "" else datetime.utcnow()
+                cache = ResponseCache(cacheFile) if cacheFile != "" else None
+                rows = fetchStation(client, cache, station, start, stop, windowDays, threads)
+        else:
+                #no range to split, make the single request as before
+                query = ""
+                if begin != "": #check for begin date. If not present, no end date will be passed either
+                        query = "?measurementTime>=" + begin
+                        if end != "":
+                                query = query + "&measurementTime<=" + end
+                if all != "": #if present in command, get all data, otherwise just the first 20 records are returned from the api
+                        query = query + ("&" if query else "?") + "limit=-1"
+                url = '%s/%s' % (client.api_root, 'sn/views/' + station + ':5minuteSamples' + query)
+                print(url)
+                rows = fetchRows(client, url)
+
+        count = writeRows(rows, outputFile, station, variable, format)
+        print(count, "rows written to", outputFile)
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
+
+
+#use arguments to define the station, date and data
+#https://hecate.hakai.org/api/sn/views/SSN693DS:5minuteSamples?measurementTime%3E=2016-01-01&measurementTime%3C=2016-02-01
+#for station only need name SSN693DS and assume :5minuteSamples
+#for date always ask for start and end
+#for data if not filled out, return all. Need to think about the output format some more
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# Recorded GPS sources for overlay.py, fed through the same pipeline as the
+# serial port.
+#
+# openSource picks the reader from the file:
+#   NMEA logs (anything starting with $) are replayed sentence by sentence,
+#   binary .gtrk tracks from gpsTrack.py and the old text tracks
+#   ("2021-06-19 17:02:36, 48.426116235, -123.349583692" or the older
+#   "17:23:25, 48 25.5653364N, 123 20.9732213W", often run together without
+#   newlines) are turned back into RMC and GGA sentences.
+# Text tracks are in local time, tzOffset hours from UTC, like overlay.py wrote them.
+#
+# Pacer holds playback to the fix times at any speed, 1 is real time, 10 ten
+# times faster and 0 as fast as the sentences can be parsed.
+
+import time
+from datetime import datetime, timedelta
+
+import gpsTrack
+import nmea
+
+
+def nmeaLog(path):
+        with open(path, "rb") as f:
+                for line in f:
+                        yield line
+
+
+def fixSentences(utc, lat, lon, date):
+        #RMC (when the date is known) then GGA for one fix, utc in seconds since midnight
+        if date is not None:
+                yield nmea.formatRMC(utc, lat, lon, date)
+        yield nmea.formatGGA(utc, lat, lon)
+
+
+def textTrack(path, tzOffset):
+        stamps, lat, lon = gpsTrack.readText(path)
+        for stamp, y, x in zip(stamps.astype(str).tolist(), lat.tolist(), lon.tolist()):
+                day, _, clock = stamp.rpartition(" ")
+                hours, minutes, seconds = clock.split(":")
+                local = timedelta(hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+                if day:
+                        utc = datetime.fromisoformat(day) + local - timedelta(hours=tzOffset)
+                        midnight = datetime(utc.year, utc.month, utc.day)
+                        yield from fixSentences((utc - midnight).total_seconds(), y, x, utc.strftime("%d%m%y"))
+                else:
+                        yield from fixSentences((local.total_seconds() - tzOffset * 3600) % 86400, y, x, None)
+
+
+def binaryTrack(path):
+        tzOffsetMinutes, seconds, lat, lon = gpsTrack.readTrack(path)
+        for local, y, x in zip(seconds.tolist(), lat.tolist(), lon.tolist()):
+                utc = datetime(1970, 1, 1) + timedelta(seconds=local - tzOffsetMinutes * 60)
+                midnight = datetime(utc.year, utc.month, utc.day)
+                yield from fixSentences((utc - midnight).total_seconds(), y, x, utc.strftime("%d%m%y"))
+
+
+def openSource(path, tzOffset=0):
+        #an iterator of raw sentences (bytes) from any of the recorded formats
+        with open(path, "rb") as f:
+                start = f.read(len(gpsTrack.MAGIC))
+        if start == gpsTrack.MAGIC:
+                return binaryTrack(path)
+        if start.lstrip()[:1] == b"$":
+                return nmeaLog(path)
+        return textTrack(path, tzOffset)
+
+
+class Pacer:
+
+        def __init__(self, speed=1):
+                self.speed = speed
+                self.start = None
+
+        def wait(self, seconds):
+                #sleep until a fix seconds after midnight is due
+                if not self.speed:
+                        return
+                if self.start is None:
+                        self.start = (time.monotonic(), seconds)
+                        self.last = seconds
+                        self.days = 0
+                        return
+                if seconds < self.last - 43200: # past midnight
+                        self.days += 1
+                self.last = seconds
+                clock, first = self.start
+                delay = clock + (seconds + self.days * 86400 - first) / self.speed - time.monotonic()
+                if delay > 0:
+                        time.sleep(delay)
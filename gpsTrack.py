@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# Compact binary GPS tracks for overlay.py, with GPX and CSV export.
+#
+# A track file is a 7 byte header, b"GTRK", a version byte and the timezone
+# offset of the timestamps in minutes (int16), followed by one record per fix.
+# A record is three zigzag varints: the change in time (tenths of a second of
+# local time since 1970) and the change in latitude and longitude (1e-7
+# degrees, about 1 cm) from the previous fix, the first fix being relative to
+# zero. A fix a second from a nearby one is 3-5 bytes instead of the ~50 of a
+# text line, and a record cut short by a crash is simply dropped on reading.
+#
+# TrackWriter can thin the track as it is written: a fix is only kept when it
+# is minMetres from the last kept fix or maxSeconds after it. export can also
+# Douglas-Peucker simplify a whole track to a tolerance in metres.
+#
+# convert turns old text tracks in degrees and minutes into decimal degree
+# ones, parsing each whole file with one regex pass and converting every fix
+# with numpy, -d dates the tracks that only have times.
+#
+# gpsTrack.py pack -z -7 2021-06-19_170236_gpsTrack_data.txt track.gtrk
+# gpsTrack.py export -f gpx -t 0.5 -o track.gpx track.gtrk
+# gpsTrack.py convert -d 2021-06-19 gpsTrack_data.txt
+
+import calendar
+import getopt
+import math
+import os
+import re
+import struct
+import sys
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+
+USAGE = '''gpsTrack.py pack [-z <timezone offset hours>] [-m <min metres>] [-s <max seconds>] [-d <yyyy-mm-dd>] <text track> <binary track>
+gpsTrack.py export [-f csv|gpx] [-t <tolerance metres>] [-o <output file>] <binary track>
+gpsTrack.py convert [-d <yyyy-mm-dd>] [-o <output directory>] <text track>...'''
+
+MAGIC = b"GTRK"
+VERSION = 1
+HEADER = struct.Struct("<4sBh")
+TICKS = 10 # time steps per second
+SCALE = 10000000 # coordinate steps per degree
+EARTH_RADIUS = 6371000.0
+
+
+def toTicks(timeStamp):
+        #naive local datetime (or seconds since 1970) to tenths of a second
+        if isinstance(timeStamp, datetime):
+                return calendar.timegm(timeStamp.timetuple()) * TICKS + timeStamp.microsecond * TICKS // 1000000
+        return int(round(timeStamp * TICKS))
+
+
+def zigzag(value):
+        return (value << 1) ^ (value >> 63)
+
+
+def varint(value, out):
+        while value > 127:
+                out.append(value & 127 | 128)
+                value >>= 7
+        out.append(value)
+
+
+def metres(lat1, lon1, lat2, lon2):
+        #equirectangular distance, plenty for fixes metres apart
+        x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+        y = math.radians(lat2 - lat1)
+        return EARTH_RADIUS * math.hypot(x, y)
+
+
+class TrackWriter:
+
+        def __init__(self, path, tzOffsetMinutes=0, minMetres=0, maxSeconds=None, buffering=65536):
+                self.f = open(path, "wb", buffering=buffering)
+                self.f.write(HEADER.pack(MAGIC, VERSION, tzOffsetMinutes))
+                self.previous = (0, 0, 0)
+                self.minMetres = minMetres
+                self.maxTicks = maxSeconds * TICKS if maxSeconds else None
+                self.kept = None
+                self.pending = None
+
+        def add(self, timeStamp, lat, lon):
+                #add a fix, returns True if it was kept
+                fix = (toTicks(timeStamp), lat, lon)
+                if self.kept is not None and self.minMetres:
+                        ticks, keptLat, keptLon = self.kept
+                        if metres(keptLat, keptLon, lat, lon) < self.minMetres and (self.maxTicks is None or fix[0] - ticks < self.maxTicks):
+                                self.pending = fix
+                                return False
+                self.write(fix)
+                return True
+
+        def write(self, fix):
+                ticks, lat, lon = fix
+                current = (ticks, int(round(lat * SCALE)), int(round(lon * SCALE)))
+                out = bytearray()
+                for value, previous in zip(current, self.previous):
+                        varint(zigzag(value - previous), out)
+                self.f.write(out)
+                self.previous = current
+                self.kept = fix
+                self.pending = None
+
+        def flush(self):
+                self.f.flush()
+
+        def close(self):
+                #the last fix always ends the track, even if it was thinned out
+                if self.pending is not None:
+                        self.write(self.pending)
+                self.f.close()
+
+
+def decodeVarints(data):
+        #all the complete varints in data as int64, decoded without a python loop
+        b = np.frombuffer(data, np.uint8)
+        ends = np.flatnonzero(b < 128)
+        if not len(ends):
+                return np.zeros(0, np.int64)
+        b = b[:ends[-1] + 1]
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        position = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+        values = (b & 127).astype(np.int64) << (7 * position)
+        values = np.add.reduceat(values, starts)
+        return (values >> 1) ^ -(values & 1)
+
+
+def readArrays(path):
+        #(tz offset minutes, ticks, lat, lon) with coordinates in fixed point
+        with open(path, "rb") as f:
+                data = f.read()
+        magic, version, tzOffsetMinutes = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not a version %d GPS track" % (path, VERSION))
+        deltas = decodeVarints(data[HEADER.size:])
+        deltas = deltas[:len(deltas) - len(deltas) % 3].reshape(-1, 3)
+        ticks, lat, lon = np.cumsum(deltas, axis=0).T
+        return tzOffsetMinutes, ticks, lat, lon
+
+
+def readTrack(path):
+        #(tz offset minutes, seconds since 1970 local time, lat, lon in degrees)
+        tzOffsetMinutes, ticks, lat, lon = readArrays(path)
+        return tzOffsetMinutes, ticks / TICKS, lat / SCALE, lon / SCALE
+
+
+def douglasPeucker(lat, lon, tolerance):
+        #boolean mask of the fixes to keep so no dropped fix is more than
+        #tolerance metres from the simplified line
+        keep = np.zeros(len(lat), bool)
+        if len(lat) < 3:
+                keep[:] = True
+                return keep
+        #project to local metres once, then it's plain 2D geometry
+        y = np.radians(lat - lat[0]) * EARTH_RADIUS
+        x = np.radians(lon - lon[0]) * EARTH_RADIUS * math.cos(math.radians(lat.mean()))
+        keep[0] = keep[-1] = True
+        stack = [(0, len(lat) - 1)]
+        while stack:
+                first, last = stack.pop()
+                if last - first < 2:
+                        continue
+                dx, dy = x[last] - x[first], y[last] - y[first]
+                px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+                length = math.hypot(dx, dy)
+                if length:
+                        distance = np.abs(px * dy - py * dx) / length
+                else:
+                        distance = np.hypot(px, py)
+                worst = int(np.argmax(distance))
+                if distance[worst] > tolerance:
+                        middle = first + 1 + worst
+                        keep[middle] = True
+                        stack.append((first, middle))
+                        stack.append((middle, last))
+        return keep
+
+
+def timeStamps(seconds):
+        return [datetime(1970, 1, 1) + timedelta(seconds=s) for s in seconds.tolist()]
+
+
+def writeCsv(output, tzOffsetMinutes, seconds, lat, lon):
+        #the same "timestamp, lat, lon" lines overlay.py used to write
+        for timeStamp, y, x in zip(timeStamps(seconds), lat.tolist(), lon.tolist()):
+                output.write("%s, %s, %s\n" % (timeStamp, round(y, 7), round(x, 7)))
+
+
+def writeGpx(output, tzOffsetMinutes, seconds, lat, lon):
+        #GPX times are UTC, so the track's timezone offset is taken back off
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write('<gpx version="1.1" creator="gpsTrack.py" xmlns="http://www.topografix.com/GPX/1/1">\n<trk><trkseg>\n')
+        for timeStamp, y, x in zip(timeStamps(seconds - tzOffsetMinutes * 60), lat.tolist(), lon.tolist()):
+                output.write('<trkpt lat="%.7f" lon="%.7f"><time>%sZ</time></trkpt>\n' % (y, x, timeStamp.isoformat()))
+        output.write('</trkseg></trk>\n</gpx>\n')
+
+
+EXPORTERS = {"csv": writeCsv, "gpx": writeGpx}
+
+
+# one fix of a text track, either "2021-06-19 17:02:36, 48.426116235, -123.349583692"
+# as overlay.py writes them now, the older "17:23:25, 48 25.5653364N, 123 20.9732213W"
+# or "18:00:19, 73.56590539999999, 143.9715651" from in between. Old files often
+# lost their newlines, so fixes are found wherever they start rather than line
+# by line; the lookahead stops a decimal longitude eating the timestamp of a
+# fix run on after it
+DECIMAL = rb"(-?\d+\.\d+?)(?=\d{4}-\d\d-\d\d |\d\d:\d\d:\d\d|\D|$)"
+TEXT_FIX = re.compile(rb"((?:\d{4}-\d\d-\d\d )?\d\d:\d\d:\d\d(?:\.\d+)?), "
+        rb"(?:" + DECIMAL + rb", " + DECIMAL + rb"|(\d+) (\d+\.\d+)([NS]), (\d+) (\d+\.\d+)([EW]))")
+
+
+def parseText(data):
+        #(timestamps, lat, lon) arrays for every fix in a text track. The regex
+        #pulls out the fields, then every fix is converted to decimal degrees at once
+        fields = TEXT_FIX.findall(data)
+        if not fields:
+                return np.zeros(0, "S1"), np.zeros(0), np.zeros(0)
+        fields = np.array(fields, "S32") # a fixed width is twice as fast as letting numpy find one
+        decimal = fields[:, 1] != b""
+        fields[fields == b""] = b"0"
+        numbers = fields[:, [1, 2, 3, 4, 6, 7]].astype(float)
+        lat = np.where(decimal, numbers[:, 0], (numbers[:, 2] + numbers[:, 3] / 60) * np.where(fields[:, 5] == b"S", -1, 1))
+        lon = np.where(decimal, numbers[:, 1], (numbers[:, 4] + numbers[:, 5] / 60) * np.where(fields[:, 8] == b"W", -1, 1))
+        return fields[:, 0], lat, lon
+
+
+def datedStamps(stamps, day):
+        #put day (yyyy-mm-dd) in front of the timestamps that only have a time
+        if day is None:
+                return stamps
+        return np.where(np.char.find(stamps, b"-") < 0, np.char.add(day.encode() + b" ", stamps), stamps)
+
+
+def stampSeconds(stamps):
+        #dated timestamps to seconds since 1970, in whatever timezone they were written
+        if np.any(np.char.find(stamps, b"-") < 0):
+                raise ValueError("the track only has times, give its date with -d")
+        return stamps.astype("datetime64[ms]").astype(np.int64) / 1000
+
+
+def readText(path, day=None):
+        with open(path, "rb") as f:
+                stamps, lat, lon = parseText(f.read())
+        return datedStamps(stamps, day), lat, lon
+
+
+def writeDecimal(path, stamps, lat, lon):
+        #"timestamp, lat, lon" lines in decimal degrees, formatted in one go
+        with open(path, "w") as f:
+                f.write(("%s, %.9f, %.9f\n" * len(lat)) % tuple(chain.from_iterable(zip(stamps.astype(str).tolist(), lat.tolist(), lon.tolist()))))
+
+
+def pack(argv):
+        tzOffset = 0
+        minMetres = 0
+        maxSeconds = None
+        day = None
+        opts, args = getopt.getopt(argv, "z:m:s:d:")
+        for opt, arg in opts:
+                if opt == "-z":
+                        tzOffset = float(arg)
+                elif opt == "-m":
+                        minMetres = float(arg)
+                elif opt == "-s":
+                        maxSeconds = float(arg)
+                elif opt == "-d":
+                        day = arg
+        source, destination = args
+        stamps, lat, lon = readText(source, day)
+        seconds = stampSeconds(stamps)
+        writer = TrackWriter(destination, int(tzOffset * 60), minMetres, maxSeconds)
+        kept = 0
+        try:
+                for s, y, x in zip(seconds.tolist(), lat.tolist(), lon.tolist()):
+                        kept += writer.add(s, y, x)
+        finally:
+                writer.close()
+        print(len(seconds), "fixes read,", kept, "kept")
+
+
+def convert(argv):
+        #old degree minute tracks to decimal degree ones, <name>_dd.csv next to each
+        #file or in the -o directory
+        day = None
+        outputDir = None
+        opts, args = getopt.getopt(argv, "d:o:")
+        for opt, arg in opts:
+                if opt == "-d":
+                        day = arg
+                elif opt == "-o":
+                        outputDir = arg
+        for source in args:
+                stamps, lat, lon = readText(source, day)
+                output = os.path.splitext(source)[0] + "_dd.csv"
+                if outputDir:
+                        output = os.path.join(outputDir, os.path.basename(output))
+                writeDecimal(output, stamps, lat, lon)
+                print(source, len(lat), "fixes to", output)
+
+
+def export(argv):
+        format = "csv"
+        tolerance = 0
+        output = None
+        opts, args = getopt.getopt(argv, "f:t:o:")
+        for opt, arg in opts:
+                if opt == "-f":
+                        format = arg
+                elif opt == "-t":
+                        tolerance = float(arg)
+                elif opt == "-o":
+                        output = arg
+        if format not in EXPORTERS:
+                raise getopt.GetoptError("unknown format " + format)
+        source, = args
+        tzOffsetMinutes, seconds, lat, lon = readTrack(source)
+        if tolerance:
+                keep = douglasPeucker(lat, lon, tolerance)
+                seconds, lat, lon = seconds[keep], lat[keep], lon[keep]
+        f = open(output, "w") if output else sys.stdout
+        try:
+                EXPORTERS[format](f, tzOffsetMinutes, seconds, lat, lon)
+        finally:
+                if output:
+                        f.close()
+
+
+def main(argv):
+        commands = {"pack": pack, "export": export, "convert": convert}
+        if not argv or argv[0] not in commands:
+                print(USAGE)
+                sys.exit(2)
+        try:
+                commands[argv[0]](argv[1:])
+        except (getopt.GetoptError, ValueError) as e:
+                print(e)
+                print(USAGE)
+                sys.exit(2)
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
@@ -0,0 +1,72 @@
+# Local on-disk cache of Hakai sensor network view rows.
+# Rows are stored in a sqlite file keyed by station, view and measurement time,
+# alongside the time intervals that have already been fetched, so a request
+# only has to go to the API for the parts of its range that are missing.
+
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# data near the present can still be arriving from the loggers, so coverage is
+# never recorded past now minus this margin and that tail is fetched again
+SETTLE_TIME = timedelta(days=1)
+
+
+class ResponseCache:
+
+        def __init__(self, path):
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute("CREATE TABLE IF NOT EXISTS rows (station TEXT, view TEXT, time TEXT, data TEXT, PRIMARY KEY (station, view, time))")
+                self.db.execute("CREATE TABLE IF NOT EXISTS intervals (station TEXT, view TEXT, begin TEXT, end TEXT)")
+                self.db.commit()
+
+        def close(self):
+                self.db.close()
+
+        def intervals(self, station, view):
+                cursor = self.db.execute("SELECT begin, end FROM intervals WHERE station=? AND view=? ORDER BY begin", (station, view))
+                return [(datetime.strptime(b, TIME_FORMAT), datetime.strptime(e, TIME_FORMAT)) for b, e in cursor]
+
+        def missing(self, station, view, begin, end):
+                #return the parts of begin..end not already covered by stored intervals
+                gaps = []
+                start = begin
+                for b, e in self.intervals(station, view):
+                        if e < start:
+                                continue
+                        if b > end:
+                                break
+                        if b > start:
+                                gaps.append((start, b))
+                        start = max(start, e)
+                if start < end:
+                        gaps.append((start, end))
+                return gaps
+
+        def store(self, station, view, begin, end, rows):
+                #save the rows fetched for begin..end and mark that range as covered
+                self.db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                        ((station, view, i['measurementTime'][:19], json.dumps(i)) for i in rows))
+                end = min(end, datetime.utcnow() - SETTLE_TIME)
+                if end > begin:
+                        merged = self.intervals(station, view) + [(begin, end)]
+                        merged.sort()
+                        intervals = [merged[0]]
+                        for b, e in merged[1:]:
+                                if b <= intervals[-1][1]:
+                                        intervals[-1] = (intervals[-1][0], max(intervals[-1][1], e))
+                                else:
+                                        intervals.append((b, e))
+                        self.db.execute("DELETE FROM intervals WHERE station=? AND view=?", (station, view))
+                        self.db.executemany("INSERT INTO intervals VALUES (?, ?, ?, ?)",
+                                ((station, view, b.strftime(TIME_FORMAT), e.strftime(TIME_FORMAT)) for b, e in intervals))
+                self.db.commit()
+
+        def rows(self, station, view, begin, end):
+                #stored rows for begin..end (inclusive) in time order
+                cursor = self.db.execute("SELECT data FROM rows WHERE station=? AND view=? AND time>=? AND time<=? ORDER BY time",
+                        (station, view, begin.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)))
+                for (data,) in cursor:
+                        yield json.loads(data)
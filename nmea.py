@@ -0,0 +1,121 @@
+# Small NMEA 0183 parser for overlay.py.
+# Checks the *hh checksum and parses GGA, RMC and VTG sentences from any talker
+# (GP, GN, GL, ...) straight from the bytes read off the serial port. Positions
+# are converted from ddmm.mmmm to decimal degrees with arithmetic rather than
+# string splitting, so 10-20 Hz receivers leave the CPU mostly idle.
+# formatGGA and formatRMC go the other way, for replaying tracks that were only
+# saved as positions.
+
+from collections import namedtuple
+from functools import reduce
+from operator import xor
+
+# time is seconds since midnight UTC, positions are decimal degrees (south and
+# west negative), None where the receiver left a field empty
+GGA = namedtuple("GGA", "time lat lon quality satellites hdop altitude")
+RMC = namedtuple("RMC", "time valid lat lon knots course date")
+VTG = namedtuple("VTG", "course knots kmh")
+
+
+def checksumOk(line):
+        #XOR of every byte between $ and * must match the two hex digits after *
+        star = line.rfind(b"*")
+        if line[:1] != b"$" or star < 0 or len(line) < star + 3:
+                return False
+        try:
+                expected = int(line[star + 1:star + 3], 16)
+        except ValueError:
+                return False
+        return reduce(xor, line[1:star], 0) == expected
+
+
+def toDegrees(field, hemisphere):
+        #ddmm.mmmm (or dddmm.mmmm) and N/S/E/W to signed decimal degrees
+        if not field:
+                return None
+        value = float(field)
+        degrees = int(value // 100)
+        degrees = degrees + (value - degrees * 100) / 60
+        return -degrees if hemisphere in (b"S", b"W") else degrees
+
+
+def toSeconds(field):
+        #hhmmss or hhmmss.ss to seconds since midnight
+        if not field:
+                return None
+        return int(field[0:2]) * 3600 + int(field[2:4]) * 60 + float(field[4:])
+
+
+def toFloat(field):
+        return float(field) if field else None
+
+
+def toInt(field):
+        return int(field) if field else None
+
+
+def parseGGA(f):
+        # $GNGGA,233145.00,4825.5666554,N,12320.9755336,W,1,09,0.5,35.849,M,-19.924,M,0.0,*5F
+        return GGA(toSeconds(f[1]), toDegrees(f[2], f[3]), toDegrees(f[4], f[5]), toInt(f[6]), toInt(f[7]), toFloat(f[8]), toFloat(f[9]))
+
+
+def parseRMC(f):
+        # $GNRMC,233145.00,A,4825.5666554,N,12320.9755336,W,0.012,,190621,,,D*6B
+        return RMC(toSeconds(f[1]), f[2] == b"A", toDegrees(f[3], f[4]), toDegrees(f[5], f[6]), toFloat(f[7]), toFloat(f[8]), f[9].decode() or None)
+
+
+def parseVTG(f):
+        # $GNVTG,,T,,M,0.012,N,0.022,K,D*3C
+        return VTG(toFloat(f[1]), toFloat(f[5]), toFloat(f[7]))
+
+
+PARSERS = {b"GGA": parseGGA, b"RMC": parseRMC, b"VTG": parseVTG}
+
+
+def parse(line):
+        #one raw sentence (bytes, with or without the line ending) to a GGA, RMC or
+        #VTG tuple. None for other sentences, bad checksums or garbled fields
+        line = line.strip()
+        parser = PARSERS.get(line[3:6])
+        if parser is None or not checksumOk(line):
+                return None
+        try:
+                return parser(line[:line.rfind(b"*")].split(b","))
+        except (ValueError, IndexError):
+                return None
+
+
+def sentence(body):
+        #"GPGGA,..." to a complete $...*hh sentence with its line ending
+        return b"$%s*%02X\r\n" % (body, reduce(xor, body, 0))
+
+
+def fromDegrees(degrees, width):
+        #signed decimal degrees to ddmm.mmmmmmm (dddmm.mmmmmmm for width 3) and
+        #the magnitude's sign, counted in 1e-7 minutes so minutes never round up to 60
+        units = round(abs(degrees) * 600000000)
+        whole, rest = divmod(units, 600000000)
+        minutes, fraction = divmod(rest, 10000000)
+        return b"%0*d%02d.%07d" % (width, whole, minutes, fraction), degrees < 0
+
+
+def fromSeconds(seconds):
+        #seconds since midnight to hhmmss.ss
+        centiseconds = round(seconds * 100) % 8640000
+        hours, centiseconds = divmod(centiseconds, 360000)
+        minutes, centiseconds = divmod(centiseconds, 6000)
+        return b"%02d%02d%02d.%02d" % (hours, minutes, centiseconds // 100, centiseconds % 100)
+
+
+def formatGGA(seconds, lat, lon, talker=b"GP"):
+        #a GGA sentence for a fix, with the fields we don't know left empty
+        lat, south = fromDegrees(lat, 2)
+        lon, west = fromDegrees(lon, 3)
+        return sentence(b"%sGGA,%s,%s,%s,%s,%s,1,,,,M,,M,," % (talker, fromSeconds(seconds), lat, b"S" if south else b"N", lon, b"W" if west else b"E"))
+
+
+def formatRMC(seconds, lat, lon, date, talker=b"GP"):
+        #an RMC sentence for a fix, date is ddmmyy
+        lat, south = fromDegrees(lat, 2)
+        lon, west = fromDegrees(lon, 3)
+        return sentence(b"%sRMC,%s,A,%s,%s,%s,%s,,,%s,,," % (talker, fromSeconds(seconds), lat, b"S" if south else b"N", lon, b"W" if west else b"E", date.encode()))
@@ -1,66 +1,158 @@
 import serial
+import sys, getopt
 import time
 from datetime import datetime, timedelta
 
-port = "COM" + input("Enter Comm Port ") or "1"
-baud = input("Enter Baud Rate. (Default 115200) ") or "115200"
-timeZone = input("Enter timezone offset in hours. (Default -7) ") or "-7"
-ser = serial.Serial(port, baud)
-ser.flushInput()
-#f = open("test_data.csv","w")
-
-gpsTrack = str(datetime.now().strftime('%Y-%m-%d_%H%M%S')) + "_gpsTrack_data.txt"
-
-
-def ddConvert(position, bearing):
-	#4825.5649200,N
-	#print(position)
-	#print(bearing)
-	degrees = int(position.split(".")[0][:-2])
-	#print(degrees)
-	minutes = float(position.split(str(degrees))[1]) / 60
-	#print(minutes)
-	if bearing == "S" or bearing == "W":
-		return str(round((degrees + minutes) * -1,9))
+import nmea
+import gpsTrack
+import gpsReplay
+from atomicFile import writeAtomic
+
+USAGE = '''overlay.py [-p <comm port>] [-b <baud rate>] [-z <timezone offset hours>] [-r <recorded NMEA log or track> [-x <speed>] [-q]] [-o <track file>] [-m <min metres>] [-s <max seconds>]
+The track is binary, "gpsTrack.py export -f csv -o <text track> <track file>" gives back the old "time, lat, lon" text track'''
+
+overlayFile = "overlay_data.txt"
+FLUSH_SECONDS = 5 # how often buffered track fixes are written out
+MIN_METRES = 0 # only keep fixes this far from the last one kept, 0 keeps every fix (-m)
+MAX_SECONDS = 60 # but keep at least one fix this often while thinning (-s)
+
+
+def publishOverlay(text):
+	# written atomically, so a reader only ever sees a complete fix. Windows refuses
+	# the rename while the reader has the file open, then this fix is skipped and
+	# the next one replaces it
+	try:
+		writeAtomic(overlayFile, text)
+	except PermissionError:
+		pass
+
+
+def ddConvert(degrees):
+	# Decimal degrees to the string written to the overlay and track files
+	return str(round(degrees,9))
+
+
+def serialLines(port, baud):
+	ser = serial.Serial(port, baud)
+	ser.flushInput()
+	while True:
+		yield ser.readline()
+
+
+def localTime(fixTime, date, timeZone):
+	# the fix time as a local datetime. RMC sentences give the UTC date, until
+	# one has been seen todays date is combined with the fix time
+	if date is not None:
+		return datetime.strptime(date, "%d%m%y") + timedelta(seconds=fixTime, hours=timeZone)
+	seconds = int(fixTime + timeZone * 3600) % 86400
+	today = datetime.now()
+	return datetime(today.year, today.month, today.day) + timedelta(seconds=seconds)
+
+
+def run(lines, track, timeZone, pacer=None, quiet=False):
+	# the fixes from a source of raw sentences to the overlay and track files,
+	# returns (sentences, fixes)
+	sentences = fixes = 0
+	date = None
+	lastFlush = time.monotonic()
+	for ser_bytes in lines:
+		sentences += 1
+
+		# parse and checksum the sentence, anything but a valid GGA fix is skipped
+		# $GNGGA,233145.00,4825.5666554,N,12320.9755336,W,1,09,0.5,35.849,M,-19.924,M,0.0,*5F
+		# $GPGGA,000946,4825.5229,N,12322.1836,W,1,04,3.1,101.4,M,-17.9,M,,*70
+		fix = nmea.parse(ser_bytes)
+		if isinstance(fix, nmea.RMC) and fix.date:
+			date = fix.date
+		if not isinstance(fix, nmea.GGA) or fix.time is None or fix.lat is None or fix.lon is None:
+			continue
+		if pacer is not None:
+			pacer.wait(fix.time)
+
+		# only write whole second fixes
+		if fix.time % 1 > 0:
+			continue
+
+		timeStamp = localTime(int(fix.time), date, timeZone)
+		fixes += 1
+		track.add(timeStamp, fix.lat, fix.lon)
+		if time.monotonic() - lastFlush >= FLUSH_SECONDS:
+			track.flush()
+			lastFlush = time.monotonic()
+		if quiet:
+			continue
+		# Decimal Degree conversion function
+		latitude = ddConvert(fix.lat)
+		longitude = ddConvert(fix.lon)
+		line = str(timeStamp) + ", " + latitude + ", " + longitude
+		print(line)
+		publishOverlay(line)
+	return sentences, fixes
+
+
+def main(argv):
+	port = baud = timeZone = replay = None
+	speed = 1
+	quiet = False
+	minMetres = MIN_METRES
+	maxSeconds = MAX_SECONDS
+	trackFile = str(datetime.now().strftime('%Y-%m-%d_%H%M%S')) + "_gpsTrack.gtrk"
+	try:
+		opts, args = getopt.getopt(argv, "hp:b:z:r:x:qo:m:s:")
+	except getopt.GetoptError:
+		print(USAGE)
+		sys.exit(2)
+	for opt, arg in opts:
+		if opt == '-h':
+			print(USAGE)
+			sys.exit()
+		elif opt == "-p":
+			port = arg
+		elif opt == "-b":
+			baud = arg
+		elif opt == "-z":
+			timeZone = arg
+		elif opt == "-r": # replay a recorded NMEA log, binary track or old text track instead of the serial port
+			replay = arg
+		elif opt == "-x": # replay speed, 1 is real time, 0 as fast as possible
+			speed = float(arg)
+		elif opt == "-q": # don't print or publish the overlay, just write the track
+			quiet = True
+		elif opt == "-o":
+			trackFile = arg
+		elif opt == "-m": # thin the track to fixes at least this many metres apart
+			minMetres = float(arg)
+		elif opt == "-s": # while thinning, still keep a fix at least this often
+			maxSeconds = float(arg)
+
+	# ask for anything not given for the serial port, as the script always has when double clicked
+	if replay is None:
+		if port is None:
+			port = "COM" + (input("Enter Comm Port ") or "1")
+		if baud is None:
+			baud = input("Enter Baud Rate. (Default 115200) ") or "115200"
+		if timeZone is None:
+			timeZone = input("Enter timezone offset in hours. (Default -7) ") or "-7"
+	timeZone = float(timeZone or "-7")
+
+	if replay is not None:
+		lines = gpsReplay.openSource(replay, timeZone)
+		pacer = gpsReplay.Pacer(speed)
 	else:
-		return str(round(degrees + minutes,9))
-
-while True:
-	ser_bytes = ser.readline()
-	decoded_bytes = ser_bytes.decode("utf-8")
-	
-	# check for GGA line
-	if decoded_bytes.find("GGA") >= 0:
-                # $GNGGA,233145.00,4825.5666554,N,12320.9755336,W,1,09,0.5,35.849,M,-19.924,M,0.0,*5F
-                # $GPGGA,000946,4825.5229,N,12322.1836,W,1,04,3.1,101.4,M,-17.9,M,,*70
-                splitSentence = decoded_bytes.split(",")
-                if splitSentence[0] == "$GNGGA":
-                        timeStamp = datetime.strptime(splitSentence[1], '%H%M%S.%f') + timedelta(hours=int(timeZone))
-               
-                else:
-                        timeStamp = datetime.strptime(splitSentence[1], '%H%M%S') + timedelta(hours=int(timeZone))
-                        
-                if timeStamp.microsecond > 0: 
-                        continue
-            
-		# use datetime.replace() to combine todays date and the timeStamp time.
-                today = datetime.now()
-                timeStamp = timeStamp.replace(year=today.year, month=today.month, day=today.day)
-                #timeStamp = timeStamp.strftime('%Y-%m-%d_%H%M%S.%f')
-                lat = splitSentence[2]
-                latBearing = splitSentence[3]
-                long = splitSentence[4]
-                longBearing = splitSentence[5]
-                # Decimal Degree conversion function
-                latitude = ddConvert(lat,latBearing)
-                longitude = ddConvert(long,longBearing)
-                f = open("overlay_data.txt","w")
-                g = open(gpsTrack,"a")
-                #print(decoded_bytes)
-                print(str(timeStamp) + ", " + latitude + ", " + longitude)
-                f.write(str(timeStamp) + ", " + latitude + ", " + longitude)
-                g.write(str(timeStamp) + ", " + latitude + ", " + longitude + "\n")
-                f.close()
-                g.close()
-		
+		lines = serialLines(port, baud)
+		pacer = None
+
+	# the track is written in the compact binary format of gpsTrack.py, export it
+	# with "gpsTrack.py export -f csv|gpx". It stays open for the whole run with buffered writes
+	track = gpsTrack.TrackWriter(trackFile, int(timeZone * 60), minMetres, maxSeconds)
+	start = time.monotonic()
+	try:
+		sentences, fixes = run(lines, track, timeZone, pacer, quiet)
+	finally:
+		track.close()
+	seconds = time.monotonic() - start
+	print(sentences, "sentences,", fixes, "fixes in", round(seconds, 2), "s,", round(sentences / max(seconds, 1e-9)), "sentences/s")
+
 
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,135 @@
+# Durable store-and-forward spool for outputs that can be unreachable
+# (the zabbix server, the DDC panel). When a send fails the records are appended
+# to a segment log on disk, and drained in large batches, rate limited, once
+# the target is back.
+#
+# The spool directory holds numbered segment files of json lines, 00000001.log,
+# 00000002.log, ... and a drain.offset file with the segment and byte offset
+# that has been sent so far. Fully sent segments are deleted. Processes can
+# share a spool directory, append and drain hold a lock on its spool.lock file.
+
+import fcntl
+import json
+import os
+import time
+
+from atomicFile import writeAtomic
+
+SEGMENT_BYTES = 1024 * 1024
+
+
+class Spool:
+
+        def __init__(self, directory, segmentBytes=SEGMENT_BYTES):
+                self.directory = directory
+                self.segmentBytes = segmentBytes
+                self.offsetFile = os.path.join(directory, "drain.offset")
+                self.lockFile = os.path.join(directory, "spool.lock")
+                os.makedirs(directory, exist_ok=True)
+
+        def lock(self):
+                #an exclusive lock on the spool, held until the returned file is
+                #closed, so another process never drains the same records or removes
+                #a segment while this one is using it
+                f = open(self.lockFile, "a")
+                fcntl.flock(f, fcntl.LOCK_EX)
+                return f
+
+        def segments(self):
+                return sorted(f for f in os.listdir(self.directory) if f.endswith(".log"))
+
+        def segmentPath(self, name):
+                return os.path.join(self.directory, name)
+
+        def __len__(self):
+                #number of records still waiting, counts lines so only use it for reporting
+                count = 0
+                segment, offset = self.readOffset()
+                for name in self.segments():
+                        with open(self.segmentPath(name), "rb") as f:
+                                if name == segment:
+                                        f.seek(offset)
+                                count += sum(1 for line in f if line.endswith(b"\n"))
+                return count
+
+        def append(self, records):
+                #append records to the newest segment, or a new one once it is full,
+                #and fsync so they survive a crash or power cut
+                if not records:
+                        return
+                with self.lock():
+                        segments = self.segments()
+                        if segments and os.path.getsize(self.segmentPath(segments[-1])) < self.segmentBytes and self.endsCleanly(segments[-1]):
+                                name = segments[-1]
+                        else:
+                                number = int(segments[-1][:-4]) + 1 if segments else 1
+                                name = "%08d.log" % number
+                        data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+                        with open(self.segmentPath(name), "ab") as f:
+                                f.write(data)
+                                f.flush()
+                                os.fsync(f.fileno())
+
+        def endsCleanly(self, name):
+                #false if a crash left a partly written record at the end of the segment
+                with open(self.segmentPath(name), "rb") as f:
+                        f.seek(0, os.SEEK_END)
+                        if f.tell() == 0:
+                                return True
+                        f.seek(-1, os.SEEK_END)
+                        return f.read(1) == b"\n"
+
+        def readOffset(self):
+                if not os.path.exists(self.offsetFile):
+                        return None, 0
+                with open(self.offsetFile) as f:
+                        segment, offset = f.read().split()
+                return segment, int(offset)
+
+        def writeOffset(self, segment, offset):
+                writeAtomic(self.offsetFile, "%s %d" % (segment, offset), fsync=True)
+
+        def drain(self, send, batchSize=500, ratePerSecond=None):
+                #call send(records) with up to batchSize records at a time, oldest first.
+                #If send raises, draining stops, the exception is passed on and those
+                #records are tried again next time. ratePerSecond limits how fast
+                #records go out after an outage.
+                #Returns the number of records sent
+                sent = 0
+                with self.lock():
+                        segment, offset = self.readOffset()
+                        for name in self.segments():
+                                if segment is not None and name < segment:
+                                        #left over from a drain that stopped before deleting it
+                                        os.remove(self.segmentPath(name))
+                                        continue
+                                start = offset if name == segment else 0
+                                with open(self.segmentPath(name), "rb") as f:
+                                        f.seek(start)
+                                        batch = []
+                                        position = start
+                                        for line in f:
+                                                if not line.endswith(b"\n"):
+                                                        break #partly written record at the end of the log
+                                                batch.append(json.loads(line))
+                                                position += len(line)
+                                                if len(batch) >= batchSize:
+                                                        self.sendBatch(send, batch, name, position, ratePerSecond)
+                                                        sent += len(batch)
+                                                        batch = []
+                                        if batch:
+                                                self.sendBatch(send, batch, name, position, ratePerSecond)
+                                                sent += len(batch)
+                                if name != self.segments()[-1] or position >= os.path.getsize(self.segmentPath(name)):
+                                        os.remove(self.segmentPath(name))
+                                        if os.path.exists(self.offsetFile):
+                                                os.remove(self.offsetFile)
+                                segment, offset = None, 0
+                        return sent
+
+        def sendBatch(self, send, batch, segment, position, ratePerSecond):
+                began = time.time()
+                send(batch)
+                self.writeOffset(segment, position)
+                if ratePerSecond:
+                        time.sleep(max(0, len(batch) / ratePerSecond - (time.time() - began)))
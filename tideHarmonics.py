@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Offline tide predictor for tides.py.
+# Fits tidal harmonic constituents (amplitude and phase of each tidal frequency)
+# to cached IWLS wlp/wlo series for a station by least squares, stores them in
+# a small json file and predicts heights for any time range with one
+# vectorized evaluation, no network needed.
+#
+# No nodal corrections are applied, so constants are good for months rather
+# than years; refit from a recent series now and then.
+#
+# usage: tideHarmonics.py fetch -s <stationID> -t <wlp|wlo> -n <days> -c <cacheFile>
+#        tideHarmonics.py fit -s <stationID> -c <cacheFile>[,<cacheFile>...] -k <constantsFile>
+#        tideHarmonics.py check -s <stationID> -c <cacheFile> -k <constantsFile>
+#        tideHarmonics.py predict -s <stationID> -b <begin> -e <end> -k <constantsFile>
+
+import getopt
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import tides
+from atomicFile import writeAtomic
+
+USAGE = """tideHarmonics.py fetch -s <stationID> -t <wlp|wlo> -n <days> -c <cacheFile>
+tideHarmonics.py fit -s <stationID> -c <cacheFile>[,<cacheFile>...] -k <constantsFile>
+tideHarmonics.py check -s <stationID> -c <cacheFile> -k <constantsFile>
+tideHarmonics.py predict -s <stationID> -b <begin> -e <end> -k <constantsFile>"""
+
+EPOCH = np.datetime64("2000-01-01T00:00:00", "s")
+FETCH_DAYS = 30 # days per api request when fetching a long series
+
+# constituent speeds in degrees per hour, roughly in order of importance on this coast
+CONSTITUENTS = [
+        ("M2", 28.9841042), ("K1", 15.0410686), ("O1", 13.9430356), ("S2", 30.0000000),
+        ("N2", 28.4397295), ("P1", 14.9589314), ("K2", 30.0821373), ("Q1", 13.3986609),
+        ("M4", 57.9682084), ("MS4", 58.9841042), ("MN4", 57.4238337), ("M6", 86.9523127),
+        ("2N2", 27.8953548), ("NU2", 28.5125831), ("L2", 29.5284789), ("MU2", 27.9682084),
+        ("J1", 15.5854433), ("OO1", 16.1391017), ("SSA", 0.0821373), ("SA", 0.0410686),
+]
+
+
+def defaultConstantsFile(station):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "tideHarmonics_" + station + ".json")
+
+
+def defaultHistoryFile(station, code):
+        #kept apart from tides.py's cache, which only holds a few weeks of wlp
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "tideHistory_" + station + "_" + code + ".json")
+
+
+def hoursSinceEpoch(times):
+        return (times - EPOCH).astype(np.float64) / 3600
+
+
+def selectConstituents(hours):
+        #only constituents the series is long enough to tell apart (Rayleigh criterion),
+        #each has to be a full cycle away from the mean and every one already chosen
+        length = hours.max() - hours.min()
+        chosen = []
+        for name, speed in CONSTITUENTS:
+                if speed * length < 360:
+                        continue
+                if all(abs(speed - other) * length >= 360 for n, other in chosen):
+                        chosen.append((name, speed))
+        return chosen
+
+
+def designMatrix(hours, speeds):
+        #[1, cos(w t), sin(w t), ...] for every time and constituent at once
+        phases = np.radians(np.outer(hours, speeds))
+        return np.hstack([np.ones((len(hours), 1)), np.cos(phases), np.sin(phases)])
+
+
+def fit(times, values):
+        #least squares fit of the mean level and each constituent's amplitude and phase
+        hours = hoursSinceEpoch(times)
+        chosen = selectConstituents(hours)
+        speeds = np.array([speed for name, speed in chosen])
+        coefficients, residuals, rank, sv = np.linalg.lstsq(designMatrix(hours, speeds), values, rcond=None)
+        n = len(chosen)
+        a = coefficients[1:n + 1]
+        b = coefficients[n + 1:]
+        constants = {
+                "epoch": str(EPOCH),
+                "z0": float(coefficients[0]),
+                "constituents": {name: [round(float(np.hypot(a[i], b[i])), 5), round(float(np.degrees(np.arctan2(b[i], a[i])) % 360), 3), speed]
+                        for i, (name, speed) in enumerate(chosen)},
+                "fittedFrom": str(times.min()),
+                "fittedTo": str(times.max()),
+        }
+        constants["rms"] = round(float(np.sqrt(np.mean((predict(constants, times) - values) ** 2))), 4)
+        return constants
+
+
+def predict(constants, times):
+        #heights at times (datetime64 array) as the sum of every constituent's cosine
+        hours = hoursSinceEpoch(times)
+        amplitudes = np.array([c[0] for c in constants["constituents"].values()])
+        phases = np.array([c[1] for c in constants["constituents"].values()])
+        speeds = np.array([c[2] for c in constants["constituents"].values()])
+        return constants["z0"] + np.cos(np.radians(np.outer(hours, speeds) - phases)) @ amplitudes
+
+
+def predictSeries(constants, start_dt, end_dt, step=15):
+        #predictions from start_dt to end_dt every step minutes in the {eventDate: value}
+        #form tides.py caches, so they can be rendered the same way
+        times = np.arange(np.datetime64(start_dt, "m"), np.datetime64(end_dt, "m") + 1, step).astype("datetime64[s]")
+        values = predict(constants, times)
+        return {str(t) + "Z": round(float(v), 3) for t, v in zip(times, values)}
+
+
+def loadConstants(path):
+        with open(path) as f:
+                return json.load(f)
+
+
+def saveConstants(path, constants):
+        writeAtomic(path, json.dumps(constants, indent=1))
+
+
+def loadSeries(cacheFiles):
+        data = {}
+        for cacheFile in cacheFiles:
+                data.update(tides.loadCache(cacheFile))
+        return tides.seriesArrays(data)
+
+
+def fetchHistory(station, code, days, cacheFile):
+        #the last days of a series, FETCH_DAYS at a time, into a cache file in tides.py's format
+        data = tides.loadCache(cacheFile)
+        end_dt = datetime.utcnow().replace(microsecond=0)
+        start_dt = end_dt - timedelta(days=days)
+        while start_dt < end_dt:
+                stop = min(start_dt + timedelta(days=FETCH_DAYS), end_dt)
+                for x in tides.fetchSeries(station, start_dt, stop, code=code):
+                        data[x["eventDate"]] = x["value"]
+                start_dt = stop
+        #not tides.saveCache, that prunes to the last few days
+        writeAtomic(cacheFile, json.dumps({"station": station, "timeSeriesCode": code, "fetched": end_dt.strftime(tides.EVENT_FORMAT), "data": data}))
+        return len(data)
+
+
+def main(argv):
+        if not argv or argv[0] not in ("fetch", "fit", "check", "predict"):
+                print(USAGE)
+                sys.exit(2)
+        command = argv[0]
+        station = tides.stationID
+        code = "wlo"
+        days = 90
+        cacheFiles = []
+        constantsFile = ""
+        begin = datetime.utcnow().strftime("%Y-%m-%d")
+        end = ""
+        try:
+                opts, args = getopt.getopt(argv[1:], "hs:t:n:c:k:b:e:", ["station=", "code=", "days=", "cache=", "constants=", "begin=", "end="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-s", "--station"):
+                        station = arg
+                elif opt in ("-t", "--code"):
+                        code = arg
+                elif opt in ("-n", "--days"):
+                        days = int(arg)
+                elif opt in ("-c", "--cache"):
+                        cacheFiles.extend(arg.split(","))
+                elif opt in ("-k", "--constants"):
+                        constantsFile = arg
+                elif opt in ("-b", "--begin"):
+                        begin = arg
+                elif opt in ("-e", "--end"):
+                        end = arg
+        if constantsFile == "":
+                constantsFile = defaultConstantsFile(station)
+        if not cacheFiles:
+                cacheFiles = [defaultHistoryFile(station, code)]
+
+        if command == "fetch":
+                print(fetchHistory(station, code, days, cacheFiles[0]), code, "values in", cacheFiles[0])
+        elif command == "fit":
+                times, values = loadSeries(cacheFiles)
+                constants = fit(times, values)
+                constants["station"] = station
+                saveConstants(constantsFile, constants)
+                print(len(constants["constituents"]), "constituents fitted to", len(times), "values,", constants["fittedFrom"], "to", constants["fittedTo"])
+                print("rms residual", constants["rms"], "m")
+        elif command == "check":
+                constants = loadConstants(constantsFile)
+                times, values = loadSeries(cacheFiles)
+                error = predict(constants, times) - values
+                print("checked against", len(times), "cached values,", str(times.min()), "to", str(times.max()))
+                print("rms", round(float(np.sqrt(np.mean(error ** 2))), 4), "m, max", round(float(np.abs(error).max()), 4), "m")
+        else:
+                constants = loadConstants(constantsFile)
+                start_dt = datetime.fromisoformat(begin)
+                end_dt = datetime.fromisoformat(end) if end != "" else start_dt + timedelta(days=1)
+                for eventDate, value in predictSeries(constants, start_dt, end_dt).items():
+                        print(eventDate, value)
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
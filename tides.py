@@ -1,18 +1,28 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # coding: utf8
 
 ## Script to get the times and height of low and high tides in a given day
 ## at a given place.
-## Will work with Python 2.x with a slight change in the last line and
-## removing '3' at end of the top line shebang
+## Predictions for the next couple of weeks are fetched in one request and kept
+## in a local cache, so most runs (and any day in the horizon) are rendered
+## without touching the network, and it keeps working offline.
+##
+## usage: tides.py -d <date> -n <days> -r <resolutionMinutes> -s <stationID> -o <outputFile> -c <cacheFile> -H <horizonDays> [-p]
+## With -p, or when nothing is cached for the day, heights come from the station's
+## harmonic constants fitted by tideHarmonics.py instead of the api.
+## Several stations can be given as -s id1,id2,... and are fetched concurrently,
+## each written to -o with {station} replaced by the station id.
 
-import sys
+import sys, getopt
+import os
 import requests
 import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-f=open("/var/www/html/todaysTide.html", "w+")
-output = []
+from atomicFile import writeAtomic
+
 pixelHeight = 8
 maxTideHeight = 3
 
@@ -20,60 +30,245 @@ maxTideHeight = 3
 # Parameters, these should be command line arguments
 #
 TZ          = -7  # ADT, -8 for AST
-date        = datetime.today().strftime("%Y-%m-%d")
 stationID   = "5cebf1df3d0f4a073c4bbd1e"
 timeSeriesCode = "wlp"
+outputFile  = "/var/www/html/todaysTide.html"
+stationOutputFile = "/var/www/html/todaysTide_{station}.html" # default with more than one station
+
+HORIZON_DAYS = 14 # days of predictions to fetch at once
+REFRESH_DAYS = 3  # fetch again once fewer than this many days are cached ahead
+KEEP_DAYS    = 7  # days of past predictions kept in the cache
 
 # One or the other of stationID or stationName must be given.
 # The stationName does not have to be a perfect match to the actual name
 # found in the Index of Sites: http://www.tides.gc.ca/eng/station/list
 # For example 'shediac' will match 'Shediac Bay *'.
 
-# Need UTC time for start and end of the date
+webPage = "https://api-iwls.dfo-mpo.gc.ca/api/v1/stations/"
+USAGE = "tides.py -d <date> -n <days> -r <resolutionMinutes> -s <stationID> -o <outputFile> -c <cacheFile> -H <horizonDays> [-p]"
+EVENT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-start_dt = datetime.strptime(date + " 00:00:00", "%Y-%m-%d %H:%M:%S") - timedelta(hours=TZ)
-end_dt = datetime.strptime(date + " 23:59:59", "%Y-%m-%d %H:%M:%S") - timedelta(hours=TZ)
 
-# Convert the times to strings as needed for the search
-sdt = start_dt.strftime("%Y-%m-%dT%H:%M:%S")
-edt =   end_dt.strftime("%Y-%m-%dT%H:%M:%S")
+def defaultCacheFile(station):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "tideCache_" + station + ".json")
+
+
+def utcRange(date, days=1):
+        # Need UTC time for start and end of the date
+        start_dt = datetime.strptime(date + " 00:00:00", "%Y-%m-%d %H:%M:%S") - timedelta(hours=TZ)
+        end_dt = start_dt + timedelta(days=days) - timedelta(seconds=1)
+        return start_dt, end_dt
+
+
+def fetchSeries(station, start_dt, end_dt, session=requests, code=None):
+        # Convert the times to strings as needed for the search
+        sdt = start_dt.strftime("%Y-%m-%dT%H:%M:%S")
+        edt =   end_dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+        # The geographic coordinates in the search correspond to earth as a whole;
+        # the metadata station_id or stations_name will be used to select the area
+
+        # Using station_id metadata
+        url = webPage + station + "/data?time-series-code=" + (code or timeSeriesCode) + "&from=" + sdt + "Z&to=" + edt + "Z"
+        response = session.get(url)
+        response.raise_for_status()
+        return response.json()
+
+
+def loadCache(cacheFile):
+        #{"eventDate": value} of every cached prediction
+        if not os.path.exists(cacheFile):
+                return {}
+        with open(cacheFile) as f:
+                return json.load(f)["data"]
+
+
+def saveCache(cacheFile, station, data):
+        #keep only recent and future predictions, written atomically
+        oldest = (datetime.utcnow() - timedelta(days=KEEP_DAYS)).strftime(EVENT_FORMAT)
+        data = {k: v for k, v in data.items() if k >= oldest}
+        writeAtomic(cacheFile, json.dumps({"station": station, "timeSeriesCode": timeSeriesCode, "fetched": datetime.utcnow().strftime(EVENT_FORMAT), "data": data}))
+        return data
+
+
+def updateCache(station, cacheFile, date, horizonDays, session=requests):
+        #make sure the cache covers date plus REFRESH_DAYS, fetching a new
+        #horizonDays of predictions in one request when it runs low.
+        #If the api can't be reached whatever is cached is used
+        data = loadCache(cacheFile)
+        needed = utcRange(date, REFRESH_DAYS)[1].strftime(EVENT_FORMAT)
+        if data and max(data) >= needed and min(data) <= utcRange(date)[0].strftime(EVENT_FORMAT):
+                return data
+        start_dt, end_dt = utcRange(date, horizonDays)
+        try:
+                series = fetchSeries(station, start_dt, end_dt, session)
+        except (requests.RequestException, ValueError) as e:
+                print("Unable to fetch predictions, using the cache:", e)
+                return data
+        for x in series:
+                data[x["eventDate"]] = x["value"]
+        return saveCache(cacheFile, station, data)
+
+
+def seriesArrays(data):
+        #cached {eventDate: value} as sorted numpy arrays of UTC datetime64[s] and heights.
+        #numpy parses the whole array of ISO dates at once
+        eventDates = sorted(data)
+        times = np.array([k.rstrip("Z") for k in eventDates], dtype="datetime64[s]")
+        values = np.array([data[k] for k in eventDates], dtype=float)
+        return times, values
+
+
+def resample(times, values, start, days, resolution=60, maxGap=None):
+        #heights at every resolution minutes of days local days from start, as a
+        #(days, samples per day) array, linearly interpolated from the series
+        #whatever its cadence. Points further than maxGap minutes from data on
+        #either side (default two resolution steps or the series step) are nan
+        perDay = 24 * 60 // resolution
+        grid = np.datetime64(start, "s") + np.arange(days * perDay) * np.timedelta64(resolution * 60, "s")
+        x = grid.astype(np.int64)
+        xp = times.astype(np.int64)
+        if len(xp) == 0:
+                heights = np.full(len(x), np.nan)
+        else:
+                heights = np.interp(x, xp, values, left=np.nan, right=np.nan)
+        if len(xp) > 1:
+                if maxGap is None:
+                        maxGap = max(2 * resolution, int(np.median(np.diff(xp))) // 60)
+                after = np.clip(np.searchsorted(xp, x), 1, len(xp) - 1)
+                heights[(xp[after] - xp[after - 1]) > maxGap * 60] = np.nan
+        return grid.reshape(days, perDay), heights.reshape(days, perDay)
+
+
+def pixelHeights(heights):
+        #convert the tide heights to pixel heights, nan stays nan for missing.
+        #Lows under chart datum are real negative heights, so no number can mark missing
+        return np.rint(heights * pixelHeight / maxTideHeight)
+
+
+def heightsGrid(data, date, days=1, resolution=60):
+        #pixel heights for days local days starting at date, one row per day
+        times, values = seriesArrays(data)
+        start_dt = utcRange(date)[0]
+        grid, heights = resample(times, values, start_dt, days, resolution)
+        return pixelHeights(heights)
+
+
+def predictedData(station, date, days):
+        #predictions from the station's fitted harmonic constants, if it has any
+        import tideHarmonics
+        constantsFile = tideHarmonics.defaultConstantsFile(station)
+        if not os.path.exists(constantsFile):
+                return {}
+        start_dt, end_dt = utcRange(date, days)
+        return tideHarmonics.predictSeries(tideHarmonics.loadConstants(constantsFile), start_dt, end_dt)
+
+
+def renderStation(station, cacheFile, output, date, days, resolution, horizonDays, session=requests, offline=False):
+        #update the station's cache if needed and write its pixel heights to output.
+        #Falls back on the harmonic predictor when the day isn't cached.
+        #Returns the rows written, or None if there are no heights for date
+        if offline:
+                data = predictedData(station, date, days)
+        else:
+                data = updateCache(station, cacheFile, date, max(horizonDays, days + REFRESH_DAYS), session)
+        grid = heightsGrid(data, date, days, resolution)
+        rows = [[int(p) for p in row if not np.isnan(p)] for row in grid]
+        if not rows[0] and not offline:
+                print(station, "nothing cached for", date, "using harmonic predictions")
+                return renderStation(station, cacheFile, output, date, days, resolution, horizonDays, session, True)
+        if not rows[0]:
+                return None
+        writeAtomic(output, "".join(str(heights) + "\n" for heights in rows))
+        return rows
 
-webPage = "https://api-iwls.dfo-mpo.gc.ca/api/v1/stations/"
 
-# The geographic coordinates in the search correspond to earth as a whole;
-# the metadata station_id or stations_name will be used to select the area
+def renderStations(stations, outputTemplate, date, days, resolution, horizonDays, threads=8, offline=False):
+        #fetch and render every station concurrently over one http session
+        results = {}
+        with requests.Session() as session:
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                        futures = {station: pool.submit(renderStation, station, defaultCacheFile(station), outputTemplate.replace("{station}", station),
+                                date, days, resolution, horizonDays, session, offline) for station in stations}
+                        for station, future in futures.items():
+                                try:
+                                        results[station] = future.result()
+                                except Exception as e:
+                                        print(station, "failed:", e)
+                                        results[station] = None
+        return results
 
-# Using station_id metadata
-url = webPage + stationID + "/data?time-series-code=" + timeSeriesCode + "&from=" + sdt + "Z&to=" + edt + "Z"
 
+def main(argv):
+        station = stationID
+        date = datetime.today().strftime("%Y-%m-%d")
+        days = 1
+        resolution = 60
+        output = ""
+        cacheFile = ""
+        horizonDays = HORIZON_DAYS
+        offline = False
+        try:
+                opts, args = getopt.getopt(argv, "hd:n:r:s:o:c:H:p", ["date=", "days=", "resolution=", "station=", "output=", "cache=", "horizon=", "predict"])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-d", "--date"):
+                        date = arg
+                elif opt in ("-n", "--days"):
+                        days = int(arg)
+                elif opt in ("-r", "--resolution"):
+                        resolution = int(arg)
+                elif opt in ("-s", "--station"):
+                        station = arg
+                elif opt in ("-o", "--output"):
+                        output = arg
+                elif opt in ("-c", "--cache"):
+                        cacheFile = arg
+                elif opt in ("-H", "--horizon"):
+                        horizonDays = int(arg)
+                elif opt in ("-p", "--predict"):
+                        offline = True
+        stations = station.split(",")
+        if len(stations) > 1:
+                if output == "":
+                        output = stationOutputFile
+                if "{station}" not in output:
+                        print("With more than one station the output needs {station} in it, eg.", stationOutputFile)
+                        sys.exit(2)
+                results = renderStations(stations, output, date, days, resolution, horizonDays, offline=offline)
+                for station, rows in results.items():
+                        print(station, date, rows if rows is not None else "no predictions")
+                if None in results.values():
+                        sys.exit(1)
+                return
 
-response = requests.get(url)
-data = response.json()
+        if output == "":
+                output = outputFile
+        if cacheFile == "":
+                cacheFile = defaultCacheFile(station)
 
+        rows = renderStation(station, cacheFile, output, date, days, resolution, horizonDays, offline=offline)
+        if rows is None:
+                print("No predictions cached or harmonic constants for", date)
+                sys.exit(1)
 
-## Print header as per CHS web page
+        ## Print header as per CHS web page
 
-# English header
-print("Times and Heights for High and Low Tides")
+        # English header
+        print("Times and Heights for High and Low Tides")
 
-# French header
-#print("Heures et hauteurs des pleines et basses mers")
+        # French header
+        #print("Heures et hauteurs des pleines et basses mers")
 
-# get rid of * marking available observations
-#print(where.replace("*", ""))
-print(date)
+        print(date)
+        for heights in rows:
+                print(heights)
 
-# get only the hourly data and convert the tide height to pixel height
-for x in range(len(data)):
-        dt = datetime.strptime(data[x]["eventDate"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=TZ)
-        if dt.minute == 0:
-                #print dt,
-                #sys.stdout.write(",")
-                #print(data[x]['value'])
-                #print int(round((float(data[x]['value'])* pixelHeight/maxTideHeight)))
-                output.append(int(round((float(data[x]['value'])* pixelHeight/maxTideHeight))))
-#print data
-print output
-print >> f,output
 
-f.close()
\ No newline at end of file
+if __name__ == "__main__":
+        main(sys.argv[1:])
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Incremental reader for LoggerNet TOA5 .dat files.
+# Remembers how far each file has been read, so every call only parses the rows
+# appended since the last one, as typed numpy columns.
+#
+# A TOA5 file is 4 header lines, eg.
+# "TOA5","SGTEUS","CR1000","70321","CR1000.Std.32.03","CPU:ElliotCreek.CR1","8381","OneHour"
+# "TIMESTAMP","RECORD","BattVolt_Avg","PanelT_Avg",...
+# "TS","RN","Volts","Deg C",...
+# "","","Avg","Avg",...
+# then one csv row per record. For each file the state file keeps the inode, the
+# byte offset after the last complete row read, the header and the bytes just
+# before the offset. A file is read from its first row again when it is
+# truncated, its header changes or those bytes no longer match (LoggerNet
+# started a new file), which also lets a copy replaced by rsync carry on from
+# the same offset. Nothing after the last newline is read, so a row still being
+# written is picked up whole next time.
+#
+# usage: toa5Tail.py [-s <stateFile>] [-i <seconds>] <file.dat>...
+
+import csv
+import getopt
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from atomicFile import writeAtomic
+
+STATE_FILE = "/data/sn/toa5_offsets.json"
+USAGE = "toa5Tail.py -s <stateFile> -i <seconds> <file.dat>..."
+HEADER_LINES = 4
+FINGERPRINT = 64 # bytes before the offset checked to see it is still the same file
+CHUNK_BYTES = 64 * 1024 * 1024 # most bytes parsed in one read, a long backlog comes in several
+
+# header is (environment, names, units, processing), columns is {name: numpy array}
+# in file order and skipped counts the rows that didn't have one value per column
+Batch = namedtuple("Batch", "path header columns skipped")
+
+
+def loadState(path=STATE_FILE):
+        #{"/abs/path.dat": {"inode", "offset", "header", "fingerprint"}}
+        if not os.path.exists(path):
+                return {}
+        with open(path) as f:
+                return json.load(f)
+
+
+def saveState(state, path=STATE_FILE):
+        #written atomically so a crash never leaves a half written file
+        writeAtomic(path, json.dumps(state, indent=1, sort_keys=True))
+
+
+def readHeader(f):
+        #(the raw header, offset of the first row), or (None, 0) until all 4 lines are written
+        f.seek(0)
+        lines = [f.readline() for i in range(HEADER_LINES)]
+        if not lines[-1].endswith(b"\n"):
+                return None, 0
+        header = b"".join(lines)
+        return header, len(header)
+
+
+def parseHeader(header):
+        return tuple(csv.reader(header.decode("latin-1").splitlines()))
+
+
+def columnArray(unit, values):
+        #TS columns as datetime64, RN as int64, numbers as float64 ("NAN" is nan),
+        #anything that isn't a number is left as text
+        values = np.array(values)
+        try:
+                if unit == "TS":
+                        return values.astype("datetime64[ms]")
+                if unit == "RN":
+                        return values.astype(np.int64)
+                #np.where makes a new array wide enough for "nan", assigning it
+                #into values would cut it to the width of the column's text
+                return np.where(values == "", "nan", values).astype(np.float64)
+        except ValueError:
+                return values
+
+
+def parseRows(data, names, units):
+        #({name: array}, rows skipped) for the complete rows in data
+        rows = list(csv.reader(data.decode("latin-1").splitlines()))
+        good = [row for row in rows if len(row) == len(names)]
+        if not good:
+                return {}, len(rows)
+        return {name: columnArray(unit, values) for name, unit, values in zip(names, units, zip(*good))}, len(rows) - len(good)
+
+
+class Toa5Tail:
+
+        def __init__(self, stateFile=STATE_FILE):
+                self.stateFile = stateFile
+                self.state = loadState(stateFile)
+
+        def resumeOffset(self, f, key, size, header, dataStart):
+                #where to carry on reading, dataStart if the file is new to us or was replaced
+                known = self.state.get(key)
+                if known is None or known["header"] != header.decode("latin-1"):
+                        return dataStart
+                offset = known["offset"]
+                if size < offset:
+                        return dataStart # truncated
+                #checked even when the inode is the same, a new file can reuse it
+                fingerprint = bytes.fromhex(known["fingerprint"])
+                f.seek(offset - len(fingerprint))
+                if f.read(len(fingerprint)) != fingerprint:
+                        return dataStart # a new file with the same header
+                return offset
+
+        def read(self, path, maxBytes=CHUNK_BYTES):
+                #the rows appended to path since the last read as a Batch, None if
+                #there are none. The new offset is kept in memory until save()
+                key = os.path.abspath(path)
+                with open(path, "rb") as f:
+                        stat = os.fstat(f.fileno())
+                        header, dataStart = readHeader(f)
+                        if header is None:
+                                return None
+                        offset = self.resumeOffset(f, key, stat.st_size, header, dataStart)
+                        f.seek(offset)
+                        data = f.read(maxBytes)
+                        end = data.rfind(b"\n") + 1
+                        if end == 0 and len(data) == maxBytes:
+                                #one row longer than maxBytes, read to the end of it
+                                data += f.readline()
+                                end = data.rfind(b"\n") + 1
+                        data = data[:end]
+                        end = offset + end
+                        f.seek(max(dataStart, end - FINGERPRINT))
+                        fingerprint = f.read(end - max(dataStart, end - FINGERPRINT))
+                self.state[key] = {"inode": stat.st_ino, "offset": end, "header": header.decode("latin-1"), "fingerprint": fingerprint.hex()}
+                if not data:
+                        return None
+                parsed = parseHeader(header)
+                columns, skipped = parseRows(data, parsed[1], parsed[2])
+                return Batch(path, parsed, columns, skipped)
+
+        def readAll(self, path, maxBytes=CHUNK_BYTES):
+                #every new batch of path, a chunk at a time
+                while True:
+                        batch = self.read(path, maxBytes)
+                        if batch is None:
+                                return
+                        yield batch
+
+        def save(self):
+                #call once the batches are processed, so a crash reads them again rather than losing them
+                saveState(self.state, self.stateFile)
+
+
+def summary(batch):
+        rows = len(next(iter(batch.columns.values()))) if batch.columns else 0
+        text = "%s: %d new rows" % (batch.path, rows)
+        times = batch.columns.get("TIMESTAMP")
+        if times is not None and rows:
+                text += " %s to %s" % (times[0], times[-1])
+        if batch.skipped:
+                text += ", %d malformed rows skipped" % batch.skipped
+        return text
+
+
+def main(argv):
+        stateFile = STATE_FILE
+        interval = None
+        try:
+                opts, args = getopt.getopt(argv, "hs:i:", ["state=", "interval="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-s", "--state"):
+                        stateFile = arg
+                elif opt in ("-i", "--interval"): # keep checking the files every interval seconds
+                        interval = float(arg)
+        if not args:
+                print(USAGE)
+                sys.exit(2)
+
+        tail = Toa5Tail(stateFile)
+        while True:
+                for path in args:
+                        try:
+                                for batch in tail.readAll(path):
+                                        print(summary(batch))
+                        except OSError as e:
+                                print(path, "could not be read:", e)
+                tail.save()
+                if interval is None:
+                        break
+                time.sleep(interval)
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Local stand-in for the zabbix server trapper port, for testing the buoy
+# forwarding without the production server on 127.0.0.1:10051.
+# Speaks the ZBXD sender protocol, keeps every item it receives and can add
+# latency, drop connections or report items as failed.
+#
+# usage: zabbixFakeTrapper.py -p <port> -l <latencySeconds> -d <dropRate> -r <rejectRate>
+
+import getopt
+import json
+import random
+import socketserver
+import struct
+import sys
+import threading
+import time
+import zlib
+
+USAGE = "zabbixFakeTrapper.py -p <port> -l <latencySeconds> -d <dropRate> -r <rejectRate>"
+
+FLAG_COMPRESSED = 0x02
+FLAG_LARGE = 0x04
+
+
+def readExactly(conn, size):
+        data = b""
+        while len(data) < size:
+                chunk = conn.recv(size - len(data))
+                if not chunk:
+                        raise ConnectionError("connection closed mid packet")
+                data += chunk
+        return data
+
+
+def readPacket(conn):
+        #ZBXD, a flags byte, then data length and reserved (uncompressed length),
+        #4 bytes each or 8 bytes each for large packets, then the json
+        header = readExactly(conn, 5)
+        if header[:4] != b"ZBXD":
+                raise ValueError("not a zabbix packet")
+        flags = header[4]
+        if flags & FLAG_LARGE:
+                dataLength, reserved = struct.unpack("<QQ", readExactly(conn, 16))
+        else:
+                dataLength, reserved = struct.unpack("<II", readExactly(conn, 8))
+        data = readExactly(conn, dataLength)
+        if flags & FLAG_COMPRESSED:
+                data = zlib.decompress(data)
+        return json.loads(data.decode("utf-8"))
+
+
+def packPacket(payload):
+        data = json.dumps(payload).encode("utf-8")
+        return b"ZBXD\x01" + struct.pack("<II", len(data), 0) + data
+
+
+class TrapperHandler(socketserver.BaseRequestHandler):
+
+        def handle(self):
+                trapper = self.server.trapper
+                try:
+                        request = readPacket(self.request)
+                except (ConnectionError, ValueError):
+                        trapper.errors += 1
+                        return
+                if trapper.latency:
+                        time.sleep(trapper.latency)
+                if random.random() < trapper.dropRate:
+                        #simulate the server going away before it answers
+                        trapper.dropped += 1
+                        return
+                #stamped once the injected latency has passed, when a real server would have taken the items
+                received = time.time()
+                items = request.get("data", [])
+                failed = sum(1 for i in items if random.random() < trapper.rejectRate)
+                start = time.time()
+                with trapper.lock:
+                        trapper.packets += 1
+                        for i in items:
+                                trapper.items.append((received, i))
+                info = "processed: %d; failed: %d; total: %d; seconds spent: %.6f" % (len(items) - failed, failed, len(items), time.time() - start)
+                self.request.sendall(packPacket({"response": "success", "info": info}))
+
+
+class FakeTrapper:
+
+        def __init__(self, host="127.0.0.1", port=0, latency=0, dropRate=0, rejectRate=0):
+                #port 0 picks a free port, see self.port once created
+                self.latency = latency
+                self.dropRate = dropRate
+                self.rejectRate = rejectRate
+                self.lock = threading.Lock()
+                self.items = [] #(time accepted, item) for every item received
+                self.packets = 0
+                self.dropped = 0
+                self.errors = 0
+                socketserver.ThreadingTCPServer.allow_reuse_address = True
+                self.server = socketserver.ThreadingTCPServer((host, port), TrapperHandler)
+                self.server.daemon_threads = True
+                self.server.trapper = self
+                self.port = self.server.server_address[1]
+                self.thread = None
+
+        def start(self):
+                self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+                self.thread.start()
+                return self
+
+        def stop(self):
+                self.server.shutdown()
+                self.server.server_close()
+
+        def reset(self):
+                with self.lock:
+                        self.items = []
+                        self.packets = 0
+                        self.dropped = 0
+                        self.errors = 0
+
+
+def main(argv):
+        port = 10051
+        latency = 0
+        dropRate = 0
+        rejectRate = 0
+        try:
+                opts, args = getopt.getopt(argv, "hp:l:d:r:", ["port=", "latency=", "drop=", "reject="])
+        except getopt.GetoptError:
+                print(USAGE)
+                sys.exit(2)
+        for opt, arg in opts:
+                if opt == '-h':
+                        print(USAGE)
+                        sys.exit()
+                elif opt in ("-p", "--port"):
+                        port = int(arg)
+                elif opt in ("-l", "--latency"):
+                        latency = float(arg)
+                elif opt in ("-d", "--drop"):
+                        dropRate = float(arg)
+                elif opt in ("-r", "--reject"):
+                        rejectRate = float(arg)
+
+        trapper = FakeTrapper(port=port, latency=latency, dropRate=dropRate, rejectRate=rejectRate).start()
+        print("fake trapper listening on port", trapper.port)
+        try:
+                while True:
+                        time.sleep(5)
+                        with trapper.lock:
+                                for received, item in trapper.items:
+                                        print(time.strftime("%H:%M:%S", time.localtime(received)), item.get("host"), item.get("key"), item.get("value"), item.get("clock"))
+                                trapper.items = []
+        except KeyboardInterrupt:
+                trapper.stop()
+
+
+if __name__ == "__main__":
+        main(sys.argv[1:])